@@ -1,11 +1,17 @@
 #!/bin/bash
+# Usage: . get_enron.sh [--no-extract]
+#   --no-extract  keep only the tarball; src/maildir_index.py reads it directly
 
 PROJECT_DIR="$(pwd)"   # current directory
 echo PROJECT_DIR
 echo "Downloading Enron dataset..."
 wget https://www.cs.cmu.edu/~enron/enron_mail_20150507.tar.gz
 
-echo "Extracting dataset..."
-tar -xzvf enron_mail_20150507.tar.gz
+if [ "$1" = "--no-extract" ]; then
+    echo "Skipping extraction; the index is built from the tarball."
+else
+    echo "Extracting dataset..."
+    tar -xzvf enron_mail_20150507.tar.gz
+fi
 
 echo "Done! Dataset is ready."
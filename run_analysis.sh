@@ -23,20 +23,11 @@ conda activate 674_final
 # ------------------------------------------------------
 # 3. Pipeline steps
 # ------------------------------------------------------
-echo "[1/5] Extracting internal email list..."
-python src/extract.py
-
-echo "[2/5] Computing email statistics..."
-python src/email_stats.py
-
-echo "[3/5] Building email matrices..."
-python src/email_matrix.py
-
-echo "[4/5] Running centrality & community analysis..."
-python src/analyze_matrix.py
-
-echo "[5/5] Generating plots from matrix analysis..."
-python src/analyze_results.py
+# Stages run through src/pipeline.py: each one is skipped when its inputs,
+# code and outputs are unchanged since its last successful run, and
+# independent stages run concurrently. Logs: results/logs/<stage>.log
+# (index → extract → stats/matrices → centralities → plots)
+python src/pipeline.py email_stats analyze_results "$@"
 
 echo "======================================================"
 echo " Analysis Complete! See results/ and results/figures/"
@@ -1,98 +1,240 @@
 import os
+import argparse
 import numpy as np
 import pandas as pd
-import networkx as nx
+import scipy.sparse as sp
+from centrality import (betweenness_centrality, closeness_harmonic, eigenvector_centrality,
+                        pagerank, threshold_edges, weighted_degree)
+from communities import louvain_sweep
+from email_matrix import (BUCKETS, EDGE_FIELDS, MATRIX_DIR, NETWORK_DIR, TENSOR_FILE,
+                          csr_line_sums, load_csr, load_edge_tensor)
+from node_tables import save_nodes, save_table
+from profiling import stage, write_report
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 USER_LIST = os.path.join(BASE_DIR, "data", "email_address", "enron_emails.txt")
-MATRIX_FILE = os.path.join(BASE_DIR, "data", "matrix", "email_matrix.npy")
-NETWORK_FILE = os.path.join(BASE_DIR, "data", "matrix", "network_email_communication.npy")
 OUT_DIR = os.path.join(BASE_DIR, "results", "matrix_analysis")
+CACHE_DIR = os.path.join(OUT_DIR, "cache")
 
 os.makedirs(OUT_DIR, exist_ok=True)
 
+# Number of sampled betweenness sources (None = exact)
+BETWEENNESS_K = 50
+# Closeness/harmonic pivots per connected component, or target error (None = exact)
+CLOSENESS_K = None
+CLOSENESS_ERROR = None
+# Edges with fewer emails than this are dropped before computing centralities
+MIN_EDGE_WEIGHT = 3
+# Louvain sweep; communities.parquet uses the first resolution
+RESOLUTIONS = (1.0,)
+SEEDS = (0,)
+
 def load_users(path):
     with open(path, "r") as f:
         return [line.strip().lower() for line in f]
 
 
-def analyze_matrices():
+def analyze_matrices(M=None, W=None, out_dir=OUT_DIR, betweenness_k=BETWEENNESS_K,
+                     closeness_k=CLOSENESS_K, closeness_error=CLOSENESS_ERROR, workers=1,
+                     resolutions=RESOLUTIONS, seeds=SEEDS):
+    """
+    Compute basic stats, centralities and communities into out_dir, as
+    Parquet tables keyed by node_id (see node_tables.py).
+    M/W default to the saved directional and symmetric matrices, which
+    are memory-mapped rather than read into RAM.
+    betweenness_k sources are sampled for betweenness (None = exact);
+    closeness and harmonic centrality use closeness_k pivots per component,
+    or enough for closeness_error (both None = exact);
+    Louvain runs once per resolution and seed. All are spread over
+    `workers` processes.
+    """
     users = load_users(USER_LIST)
     N = len(users)
+    os.makedirs(out_dir, exist_ok=True)
+
+    if M is None:
+        M = load_csr(MATRIX_DIR, mmap_mode="r")
+        W = load_csr(NETWORK_DIR, mmap_mode="r")
+    if M.shape[0] != N:
+        raise ValueError(f"Matrices have {M.shape[0]} rows but {USER_LIST} lists {N} users; "
+                         "rerun email_matrix.py")
 
-    M = np.load(MATRIX_FILE)
-    W = np.load(NETWORK_FILE)
+    # node_id → email dictionary, shared by all tables below
+    save_nodes(users, out_dir)
 
     # -----------------------------------
     # 1. Basic stats: sent/received
     # -----------------------------------
-    sent = M.sum(axis=1)
-    received = M.sum(axis=0)
-    balance = (sent - received) / (sent + received + 1e-9)
+    with stage("basic_stats") as counts:
+        sent, received = csr_line_sums(M)
+        balance = (sent - received) / (sent + received + 1e-9)
+        counts["edges"] = int(M.nnz)
 
     df_basic = pd.DataFrame({
-        "email": users,
         "sent": sent,
         "received": received,
         "balance": balance
     })
-    df_basic.to_csv(os.path.join(OUT_DIR, "basic_stats.csv"), index=False)
+    save_table(df_basic, "basic_stats", out_dir)
 
     # -----------------------------------
-    # 2. Build graph
+    # 2. Thresholded sparse adjacency
     # -----------------------------------
-    G = nx.from_numpy_array(W)
-    G.remove_edges_from([(u, v) for u, v, w in G.edges(data="weight") if w < 3])
+    with stage("threshold") as counts:
+        A = threshold_edges(W, MIN_EDGE_WEIGHT)
+        counts["edges"] = int(A.nnz)
 
     # -----------------------------------
     # 3. Compute centralities
     # -----------------------------------
-    degree = dict(G.degree(weight="weight"))
-
-    # --- FAST betweenness (approximate) ---
-    betweenness = nx.betweenness_centrality(
-        G,
-        k=min(50, len(G)),  # sample up to 50 nodes
-        weight="weight",
-        normalized=True,
-        seed=123
-    )
-    closeness = nx.closeness_centrality(G)
-    pagerank = nx.pagerank(G, weight="weight", max_iter=200)
-    eigen = nx.eigenvector_centrality(
-        G,
-        max_iter=300,
-        tol=1e-05,
-        weight="weight"
-    )
-
+    with stage("degree"):
+        degree = weighted_degree(A)
+
+    # --- Betweenness: parallel Brandes on the CSR adjacency ---
+    with stage("betweenness"):
+        betweenness = betweenness_centrality(
+            A,
+            k=betweenness_k,  # None = exact
+            normalized=True,
+            seed=123,
+            workers=workers
+        )
+    # --- Closeness/harmonic: BFS from every node, or from sampled pivots ---
+    with stage("closeness"):
+        closeness = closeness_harmonic(A, k=closeness_k, epsilon=closeness_error, workers=workers)
+    with stage("pagerank"):
+        pr = pagerank(A, max_iter=200)
+    with stage("eigenvector"):
+        eigen = eigenvector_centrality(
+            A,
+            max_iter=300,
+            tol=1e-05
+        )
 
     df_centrality = pd.DataFrame({
-        "email": users,
-        "degree": [degree[i] for i in range(N)],
-        "betweenness": [betweenness[i] for i in range(N)],
-        "closeness": [closeness[i] for i in range(N)],
-        "pagerank": [pagerank[i] for i in range(N)],
-        "eigenvector": [eigen[i] for i in range(N)]
+        "degree": degree,
+        "betweenness": betweenness,
+        "closeness": closeness["closeness"],
+        "closeness_error": closeness["closeness_error"],
+        "harmonic": closeness["harmonic"],
+        "harmonic_error": closeness["harmonic_error"],
+        "pagerank": pr,
+        "eigenvector": eigen
     })
-    df_centrality.to_csv(os.path.join(OUT_DIR, "centrality.csv"), index=False)
+    save_table(df_centrality, "centrality", out_dir)
 
     # -----------------------------------
-    # 4. Community detection (Louvain)
+    # 4. Community detection (Louvain sweep)
     # -----------------------------------
     try:
-        import community
-        partition = community.best_partition(G, weight="weight")
+        with stage("communities") as counts:
+            runs = louvain_sweep(A, resolutions, seeds, workers=workers, cache_dir=CACHE_DIR)
+            counts["runs"] = len(runs)
+    except ImportError:
+        print("python-louvain not installed; skipping community detection.")
+    else:
+        # communities.parquet holds the best-modularity run at the first resolution
+        primary = [run for run in runs if run["resolution"] == resolutions[0]]
+        best = max(primary, key=lambda run: run["modularity"])
         df_comm = pd.DataFrame({
-            "email": users,
-            "community": [partition[i] for i in range(N)]
+            "community": best["labels"]
         })
-        df_comm.to_csv(os.path.join(OUT_DIR, "communities.csv"), index=False)
-    except:
-        print("python-louvain not installed; skipping community detection.")
+        save_table(df_comm, "communities", out_dir)
+
+        df_sweep = pd.DataFrame({
+            "resolution": [run["resolution"] for run in runs],
+            "seed": [run["seed"] for run in runs],
+            "modularity": [run["modularity"] for run in runs],
+            "n_communities": [len(np.unique(run["labels"])) for run in runs],
+            "cached": [run["cached"] for run in runs],
+            "selected": [run is best for run in runs],
+        })
+        df_sweep.to_csv(os.path.join(out_dir, "community_modularity.csv"), index=False)
+        print(f"Communities: modularity {best['modularity']:.4f} "
+              f"({int(df_sweep['cached'].sum())}/{len(runs)} runs from cache)")
+
+    print("Analysis complete. Results stored in:", out_dir)
+
+
+# -----------------------------------
+# Time windows over the edge tensor
+# -----------------------------------
+def to_period(date, granularity):
+    """Convert a YYYY-MM-DD date to the tensor's week/month period number."""
+    return np.datetime64(date).astype(f"datetime64[{BUCKETS[granularity]}]").astype(np.int64)
+
+
+def period_label(period, granularity):
+    return str(np.int64(period).astype(f"datetime64[{BUCKETS[granularity]}]"))
+
+
+def window_matrices(tensor, start, end, field_weights, N):
+    """
+    Aggregate tensor periods in [start, end) into (M, W) matrices, weighting
+    To/Cc/Bcc counts by field_weights.
+    """
+    mask = (tensor["period"] >= start) & (tensor["period"] < end)
+    weights = sum(w * tensor[f][mask] for f, w in zip(EDGE_FIELDS, field_weights))
+    M = sp.coo_array((weights, (tensor["src"][mask], tensor["dst"][mask])), shape=(N, N)).tocsr()
+    M.eliminate_zeros()
+    return M, (M + M.T).tocsr()
+
+
+def analyze_windows(windows, field_weights, tensor=None, **kwargs):
+    """
+    Run analyze_matrices() for each (start, end) period window; extra
+    keyword arguments are passed through.
+    """
+    tensor = load_edge_tensor(TENSOR_FILE) if tensor is None else tensor
+    granularity = tensor["granularity"]
+    N = len(load_users(USER_LIST))
 
-    print("Analysis complete. Results stored in:", OUT_DIR)
+    for start, end in windows:
+        label = f"{period_label(start, granularity)}_{period_label(end, granularity)}"
+        print(f"Analyzing window {label}...")
+        with stage(f"window {label}"):
+            M, W = window_matrices(tensor, start, end, field_weights, N)
+            analyze_matrices(M, W, out_dir=os.path.join(OUT_DIR, "windows", label), **kwargs)
 
 
 if __name__ == "__main__":
-    analyze_matrices()
+    parser = argparse.ArgumentParser(description="Centrality and community analysis.")
+    parser.add_argument("--window", nargs=2, metavar=("START", "END"),
+                        help="analyze only messages dated in [START, END), YYYY-MM-DD")
+    parser.add_argument("--sliding", nargs=2, type=int, metavar=("WIDTH", "STEP"),
+                        help="analyze sliding windows of WIDTH buckets every STEP buckets")
+    parser.add_argument("--field-weights", nargs=3, type=float, default=[1.0, 0.0, 0.0],
+                        metavar=("TO", "CC", "BCC"),
+                        help="edge weight of To/Cc/Bcc recipients in windows (default: 1 0 0)")
+    parser.add_argument("--betweenness-k", type=int, default=BETWEENNESS_K,
+                        help=f"sampled betweenness sources, 0 for exact (default: {BETWEENNESS_K})")
+    closeness = parser.add_mutually_exclusive_group()
+    closeness.add_argument("--closeness-k", type=int, default=CLOSENESS_K,
+                           help="closeness/harmonic pivots per connected component (default: exact)")
+    closeness.add_argument("--closeness-error", type=float, default=CLOSENESS_ERROR,
+                           help="target error of each node's mean distance, as a fraction of the "
+                                "diameter; sets the pivot count (default: exact)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes for the centrality and community computations")
+    parser.add_argument("--resolutions", nargs="+", type=float, default=list(RESOLUTIONS),
+                        help="Louvain resolutions to sweep; the first one feeds communities.parquet")
+    parser.add_argument("--seeds", nargs="+", type=int, default=list(SEEDS),
+                        help="Louvain random seeds per resolution")
+    args = parser.parse_args()
+    options = {"betweenness_k": args.betweenness_k or None, "closeness_k": args.closeness_k or None,
+               "closeness_error": args.closeness_error, "workers": args.workers,
+               "resolutions": args.resolutions, "seeds": args.seeds}
+
+    if args.window:
+        tensor = load_edge_tensor(TENSOR_FILE)
+        start, end = (to_period(d, tensor["granularity"]) for d in args.window)
+        analyze_windows([(start, end)], args.field_weights, tensor, **options)
+    elif args.sliding:
+        tensor = load_edge_tensor(TENSOR_FILE)
+        width, step = args.sliding
+        first, last = tensor["period"].min(), tensor["period"].max()
+        windows = [(s, s + width) for s in range(first, last + 1, step)]
+        analyze_windows(windows, args.field_weights, tensor, **options)
+    else:
+        analyze_matrices(**options)
+    write_report("analyze_matrix", **options)
@@ -1,7 +1,10 @@
 import os
-import pandas as pd
+import argparse
+import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
+from concurrent.futures import ProcessPoolExecutor
+from node_tables import load_nodes
+from profiling import stage, write_report
 
 # ------------------------------------------------------
 # Paths
@@ -12,22 +15,12 @@ FIG_DIR = os.path.join(BASE_DIR, "results", "figures")
 
 os.makedirs(FIG_DIR, exist_ok=True)
 
-BASIC_STATS = os.path.join(ANALYSIS_DIR, "basic_stats.csv")
-CENTRALITY  = os.path.join(ANALYSIS_DIR, "centrality.csv")
-COMMUNITIES = os.path.join(ANALYSIS_DIR, "communities.csv")
-
 # ------------------------------------------------------
 # Load & merge datasets
 # ------------------------------------------------------
 def load_and_merge():
-    df_basic = pd.read_csv(BASIC_STATS)
-    df_cent  = pd.read_csv(CENTRALITY)
-    df_comm  = pd.read_csv(COMMUNITIES)
-
-    df = df_basic.merge(df_cent, on="email", how="left")
-    df = df.merge(df_comm, on="email", how="left")
-
-    return df
+    # basic_stats / centrality / communities Parquet tables, joined on node_id
+    return load_nodes(ANALYSIS_DIR)
 
 # ------------------------------------------------------
 # Plot helper
@@ -39,50 +32,121 @@ def save_plot(name):
 
 
 # ------------------------------------------------------
-# Analysis functions
+# Binned figure rendering
 # ------------------------------------------------------
-def plot_distribution(df, column, name):
+# Figures are drawn from pre-binned counts, so drawing cost does not grow
+# with the number of nodes: histograms come from np.histogram, the KDE
+# curve from a Gaussian smoothing of a fine grid histogram, and scatters
+# above SCATTER_LIMIT points become hexbin density plots. Each figure is
+# a job (function, args) over plain numpy arrays, the figure file name
+# first, so jobs can be rendered in worker processes.
+HIST_BINS = 50
+KDE_GRID = 512
+SCATTER_LIMIT = 50_000
+
+
+def kde_curve(values, lo, hi, bin_width, grid=KDE_GRID):
+    """
+    Gaussian KDE (Scott's bandwidth) of values on `grid` points over
+    [lo, hi], scaled to the counts of a histogram with bin_width bins.
+    Returns (x, y), or None when the values have no spread.
+    """
+    n = len(values)
+    std = values.std(ddof=1) if len(values) > 1 else 0
+    if n < 2 or std == 0 or hi <= lo:
+        return None
+    counts, edges = np.histogram(values, bins=grid, range=(lo, hi))
+    dx = edges[1] - edges[0]
+    sigma = std * n ** (-1 / 5) / dx
+    half = int(np.ceil(4 * sigma))
+    offsets = np.arange(-half, half + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+    # Few values mean a wide kernel, possibly wider than the grid: take the
+    # grid-aligned centre of the full convolution
+    smoothed = np.convolve(counts, kernel, mode="full")[half:half + grid]
+    return (edges[:-1] + edges[1:]) / 2, smoothed * bin_width / dx
+
+
+def plot_histogram(name, values, title, kde=True, xlabel=None, ylabel="Count"):
+    values = values[np.isfinite(values)]
+    counts, edges = np.histogram(values, bins=HIST_BINS)
     plt.figure(figsize=(6,4))
-    sns.histplot(df[column], bins=50, kde=True)
-    plt.title(f"Distribution of {column}")
+    plt.bar(edges[:-1], counts, width=np.diff(edges), align="edge",
+            color="C0", alpha=0.5, edgecolor="black", linewidth=0.75)
+    if kde:
+        curve = kde_curve(values, edges[0], edges[-1], edges[1] - edges[0])
+        if curve is not None:
+            plt.plot(*curve, color="C0")
+    plt.xlabel(xlabel or "")
+    plt.ylabel(ylabel)
+    plt.title(title)
     save_plot(name)
 
 
+def plot_pair(name, x, y, xlabel, ylabel):
+    """Scatter plot, or a hexbin density plot above SCATTER_LIMIT points."""
+    keep = np.isfinite(x) & np.isfinite(y)
+    x, y = x[keep], y[keep]
+    plt.figure(figsize=(6,4))
+    if len(x) > SCATTER_LIMIT:
+        plt.hexbin(x, y, gridsize=80, bins="log", mincnt=1, cmap="viridis")
+        plt.colorbar(label="nodes (log)")
+    else:
+        plt.scatter(x, y, alpha=0.6, s=12, linewidths=0)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(f"{xlabel} vs {ylabel}")
+    save_plot(name)
+
+
+def _render(job):
+    func, args = job
+    func(*args)
+    return args[0]
+
+
+def render(jobs, workers=1):
+    """Render figure jobs, across `workers` processes if more than one."""
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            names = list(pool.map(_render, jobs))
+    else:
+        names = [_render(job) for job in jobs]
+    for name in names:
+        print(f"Saved figure: {name}")
+
+
+# ------------------------------------------------------
+# Analysis functions
+# ------------------------------------------------------
+def column(df, name):
+    return df[name].to_numpy(dtype=float, na_value=np.nan)
+
+
 def top10_table(df, column):
     return df[['email', column]].sort_values(by=column, ascending=False).head(10)
 
 
-def analyze(df):
+def figure_jobs(df, kde=True):
+    jobs = []
     # --------------------------------------------------
     # 1. Basic Stats Plots
-    # --------------------------------------------------
-    plot_distribution(df, "sent", "sent_distribution.png")
-    plot_distribution(df, "received", "received_distribution.png")
-    plot_distribution(df, "balance", "balance_distribution.png")
-
-    # --------------------------------------------------
     # 2. Centrality Distributions
     # --------------------------------------------------
-    for metric in ["degree", "betweenness", "closeness", "pagerank", "eigenvector"]:
-        plot_distribution(df, metric, f"{metric}_distribution.png")
+    for metric in ["sent", "received", "balance",
+                   "degree", "betweenness", "closeness", "pagerank", "eigenvector"]:
+        jobs.append((plot_histogram, (f"{metric}_distribution.png", column(df, metric),
+                                      f"Distribution of {metric}", kde, metric)))
 
     # --------------------------------------------------
-    # 3. Community Size
+    # 3. Community Size (ignoring size 1 communities)
     # --------------------------------------------------
     community_sizes = df["community"].value_counts()
-    filtered_sizes = community_sizes[community_sizes > 1]
-
-# Print summary
-    print(community_sizes.head())
-    print("Total communities:", len(community_sizes))
-
-    # Histogram of community sizes
-    plt.figure(figsize=(6,4))
-    sns.histplot(filtered_sizes, bins=50, kde=False)
-    plt.xlabel("Community Size")
-    plt.ylabel("Count")
-    plt.title("Distribution of Community Sizes(ignoring size 1 community)")
-    save_plot("community_sizes.png")
+    filtered_sizes = community_sizes[community_sizes > 1].to_numpy(dtype=float)
+    jobs.append((plot_histogram, ("community_sizes.png", filtered_sizes,
+                                  "Distribution of Community Sizes(ignoring size 1 community)",
+                                  False, "Community Size")))
 
     # --------------------------------------------------
     # 4. Pairwise Scatter Plots
@@ -92,12 +156,18 @@ def analyze(df):
         ("betweenness", "closeness"),
         ("degree", "closeness"),
     ]
-
     for x, y in scatter_pairs:
-        plt.figure(figsize=(6,4))
-        sns.scatterplot(data=df, x=x, y=y, alpha=0.6)
-        plt.title(f"{x} vs {y}")
-        save_plot(f"{x}_vs_{y}.png")
+        jobs.append((plot_pair, (f"{x}_vs_{y}.png", column(df, x), column(df, y), x, y)))
+    return jobs
+
+
+def analyze(df, workers=1, kde=True):
+    render(figure_jobs(df, kde), workers)
+
+    community_sizes = df["community"].value_counts()
+    # Print summary
+    print(community_sizes.head())
+    print("Total communities:", len(community_sizes))
 
     # --------------------------------------------------
     # 5. Output top-10 lists to console
@@ -115,19 +185,31 @@ def analyze(df):
     print(top10_table(df, "eigenvector"))
 
     print("\n===== COMMUNITY SIZE =====")
-    print(df["community"].value_counts())
+    print(community_sizes)
 
 
 # ------------------------------------------------------
 # Main
 # ------------------------------------------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the node-level analysis results.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="render figures across this many processes")
+    parser.add_argument("--no-kde", action="store_true",
+                        help="draw histograms without the KDE curve")
+    args = parser.parse_args()
+
     print("Loading and merging datasets...")
-    df = load_and_merge()
+    with stage("load") as counts:
+        df = load_and_merge()
+        counts["nodes"] = len(df)
     print(f"Loaded {len(df)} nodes")
 
     print("Running analysis...")
-    analyze(df)
+    with stage("plots") as counts:
+        analyze(df, workers=args.workers, kde=not args.no_kde)
+        counts["nodes"] = len(df)
 
     print(f"\nAll figures saved to: {FIG_DIR}")
+    write_report("analyze_results", nodes=len(df), workers=args.workers, kde=not args.no_kde)
     print("Done.")
@@ -0,0 +1,233 @@
+import math
+import asyncio
+import hashlib
+import aiohttp
+
+# ------------------------------------------------------
+# Inference backends for role classification
+# ------------------------------------------------------
+# A backend answers chat prompts made of a system message and a user
+# message (shared instructions + one block per row). Both methods call
+# on_result(row, result) as rows finish and advance an optional tqdm-like
+# progress bar; they also return all results in row order.
+#   generate(system, instructions, blocks, answers=None, ...)
+#       free-text answers; answers optionally starts each reply ("<role>:")
+#   score(system, instructions, blocks, labels, ...)
+#       (label, probability) per row, decoding restricted to labels
+# `name` identifies the model in the result cache and `batch_size` is the
+# number of rows the backend works on at once (the checkpoint interval).
+# `usage` counts the prompt and generated tokens of the last call.
+SAMPLING = {"temperature": 0.2, "top_p": 0.9, "top_k": 50}
+TOKENIZE_CHUNK = 4096   # prompts tokenized per background chunk
+
+
+def prompt_hash(system, user):
+    """Cache key of one chat prompt."""
+    return hashlib.sha256(f"{system}\x00{user}".encode("utf-8")).hexdigest()
+
+
+# ------------------------------------------------------
+# In-process Hugging Face model
+# ------------------------------------------------------
+class HFBackend:
+    """
+    Local model with continuous batching (batch_generation). The system
+    message and instructions form a shared prefix whose KV cache is
+    computed once; row blocks are tokenized in a background thread.
+    batch_generation (torch) is imported on use, so the server backend
+    starts without it.
+    """
+
+    def __init__(self, model, tokenizer, batch_size, max_new_tokens):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        self.name = model.name_or_path
+        self.usage = {"prompt_tokens": 0, "generated_tokens": 0}
+
+    def chat_text(self, system, user):
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+
+    def _split(self, system, instructions, blocks):
+        """
+        Render the chat template once and split it around the row block.
+        Returns (prefix token ids, stream of suffix token id chunks).
+        """
+        from batch_generation import tokenize_in_background
+
+        marker = "\x00"
+        template = self.chat_text(system, instructions + marker)
+        prefix, tail = template.split(marker)
+        if blocks and prefix + blocks[0] + tail != self.chat_text(system, instructions + blocks[0]):
+            raise ValueError("chat template does not keep the user prompt verbatim")
+
+        prefix_ids = self.tokenizer(prefix, add_special_tokens=False)["input_ids"]
+        print(f"Shared prefix: {len(prefix_ids)} tokens")
+        suffixes = [block + tail for block in blocks]
+        # Tokenizing the halves separately must give the tokens of the whole prompt
+        if blocks and prefix_ids + self.tokenizer(suffixes[0], add_special_tokens=False)["input_ids"] != \
+                self.tokenizer(prefix + suffixes[0], add_special_tokens=False)["input_ids"]:
+            raise ValueError("the shared prefix does not end on a token boundary")
+        self.usage = {"prompt_tokens": 0, "generated_tokens": 0}
+
+        # Prompt tokens per row: the shared prefix plus the row's suffix
+        def counted(chunks):
+            for chunk in chunks:
+                self.usage["prompt_tokens"] += sum(len(prefix_ids) + len(ids) for ids in chunk)
+                yield chunk
+
+        return prefix_ids, counted(tokenize_in_background(self.tokenizer, suffixes, TOKENIZE_CHUNK))
+
+    def score(self, system, instructions, blocks, labels, progress=None, on_result=None):
+        from batch_generation import classify_constrained
+
+        prefix_ids, chunks = self._split(system, instructions, blocks)
+        scored = classify_constrained(
+            self.model, self.tokenizer, chunks, labels, self.batch_size, prefix=prefix_ids,
+            progress=progress,
+            on_result=None if on_result is None else lambda j, r: on_result(j, (labels[r[0]], r[1]))
+        )
+        label_ids = self.tokenizer(list(labels), add_special_tokens=False)["input_ids"]
+        self.usage["generated_tokens"] = sum(len(label_ids[label]) for label, _ in scored)
+        return [(labels[label], p) for label, p in scored]
+
+    def generate(self, system, instructions, blocks, answers=None, progress=None, on_result=None):
+        from batch_generation import generate_continuous
+
+        prefix_ids, chunks = self._split(system, instructions, blocks)
+        answer_ids = ([[] for _ in blocks] if answers is None else
+                      self.tokenizer(list(answers), add_special_tokens=False)["input_ids"])
+
+        def with_answers(chunks):
+            start = 0
+            for chunk in chunks:
+                yield [ids + answer_ids[start + i] for i, ids in enumerate(chunk)]
+                start += len(chunk)
+
+        # Decode only new tokens (after the prefilled answer, if any)
+        def decode(j, out_ids):
+            return self.tokenizer.decode(answer_ids[j] + out_ids, skip_special_tokens=True).strip()
+
+        outputs = generate_continuous(
+            self.model,
+            self.tokenizer,
+            with_answers(chunks),
+            max_batch_size=self.batch_size,
+            max_new_tokens=self.max_new_tokens,
+            do_sample=True,
+            prefix=prefix_ids,
+            progress=progress,
+            on_result=None if on_result is None else lambda j, out: on_result(j, decode(j, out)),
+            **SAMPLING
+        )
+        self.usage["generated_tokens"] = sum(len(out) for out in outputs)
+        return [decode(j, out) for j, out in enumerate(outputs)]
+
+
+# ------------------------------------------------------
+# OpenAI-compatible inference server
+# ------------------------------------------------------
+class OpenAIBackend:
+    """
+    Async client for an OpenAI-compatible /chat/completions endpoint (e.g.
+    a vLLM server, which also caches the shared prompt prefix). At most
+    `concurrency` requests are in flight over one pooled connection set;
+    429/5xx responses, dropped connections and timeouts are retried with
+    exponential backoff.
+    score() and answer prefills rely on vLLM's guided_choice and
+    continue_final_message request extensions.
+    """
+
+    def __init__(self, base_url, model, concurrency=64, max_new_tokens=128, timeout=600, retries=3):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.name = model
+        self.concurrency = concurrency
+        self.batch_size = concurrency
+        self.max_new_tokens = max_new_tokens
+        self.timeout = timeout
+        self.retries = retries
+        self.usage = {"prompt_tokens": 0, "generated_tokens": 0}
+
+    async def _post(self, session, body):
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.post(self.url, json=body) as resp:
+                    if resp.status == 200:
+                        return await resp.json()
+                    if resp.status not in (429, 500, 502, 503, 504) or attempt == self.retries:
+                        raise RuntimeError(f"{self.url} returned {resp.status}: {await resp.text()}")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                # Dropped connections and timeouts are retried like 5xx responses
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(2 ** attempt)
+
+    async def _run(self, n, make_body, parse, progress, on_result):
+        """Send n requests from `concurrency` workers sharing one session."""
+        results = [None] * n
+        rows = iter(range(n))
+        self.usage = {"prompt_tokens": 0, "generated_tokens": 0}
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            async def worker():
+                for j in rows:
+                    response = await self._post(session, make_body(j))
+                    usage = response.get("usage") or {}
+                    self.usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                    self.usage["generated_tokens"] += usage.get("completion_tokens", 0)
+                    results[j] = parse(j, response)
+                    if on_result is not None:
+                        on_result(j, results[j])
+                    if progress is not None:
+                        progress.update(1)
+
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, n))))
+        return results
+
+    def _body(self, system, user, answer=None, **options):
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+        body = {"model": self.name, "messages": messages, **options}
+        if answer is not None:
+            messages.append({"role": "assistant", "content": answer})
+            body.update(continue_final_message=True, add_generation_prompt=False)
+        return body
+
+    def score(self, system, instructions, blocks, labels, progress=None, on_result=None):
+        def make_body(j):
+            return self._body(system, instructions + blocks[j], temperature=0.0,
+                              max_tokens=32, logprobs=True, guided_choice=list(labels))
+
+        def parse(j, response):
+            choice = response["choices"][0]
+            text = choice["message"]["content"].strip()
+            label = next((label for label in labels if text.startswith(label)), text)
+            tokens = (choice.get("logprobs") or {}).get("content")
+            return label, math.exp(sum(t["logprob"] for t in tokens)) if tokens else None
+
+        return asyncio.run(self._run(len(blocks), make_body, parse, progress, on_result))
+
+    def generate(self, system, instructions, blocks, answers=None, progress=None, on_result=None):
+        def make_body(j):
+            return self._body(system, instructions + blocks[j],
+                              None if answers is None else answers[j],
+                              max_tokens=self.max_new_tokens, **SAMPLING)
+
+        def parse(j, response):
+            text = response["choices"][0]["message"]["content"]
+            return ((answers[j] if answers is not None else "") + text).strip()
+
+        return asyncio.run(self._run(len(blocks), make_body, parse, progress, on_result))
@@ -0,0 +1,359 @@
+import time
+import queue
+import threading
+import torch
+import torch.nn.functional as F
+from collections import deque
+from transformers import DynamicCache
+from transformers.generation.logits_process import (
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+# ------------------------------------------------------
+# Continuous batching for Hugging Face causal LMs
+# ------------------------------------------------------
+# The running batch is a dict:
+#   cache  - per-layer (key, value) tensors [B, heads, L, dim], left-padded
+#   mask   - attention mask [B, L]
+#   ids    - token ids [B, L] (pads included, as model.generate sees them)
+#   rows   - prompt index of every batch row
+#   out    - generated token ids of every batch row
+# Finished rows leave the batch after every step and free slots are refilled
+# with new prompts, so short answers never wait for the slowest sequence.
+
+
+def _eos_ids(model, tokenizer):
+    eos = model.generation_config.eos_token_id
+    eos = set(eos if isinstance(eos, (list, tuple)) else [eos])
+    eos.add(tokenizer.eos_token_id)
+    eos.discard(None)
+    return eos
+
+
+def _logits_processors(model, do_sample, temperature, top_k, top_p):
+    processors = LogitsProcessorList()
+    penalty = model.generation_config.repetition_penalty
+    if penalty is not None and penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(penalty))
+    if do_sample:
+        processors.append(TemperatureLogitsWarper(temperature))
+        processors.append(TopKLogitsWarper(top_k))
+        processors.append(TopPLogitsWarper(top_p))
+    return processors
+
+
+def _pad_left(batch, length, pad_id):
+    """Left-pad every tensor of a batch to sequence length `length`."""
+    extra = length - batch["mask"].shape[1]
+    if extra == 0:
+        return batch
+    return dict(
+        batch,
+        cache=[(F.pad(k, (0, 0, extra, 0)), F.pad(v, (0, 0, extra, 0))) for k, v in batch["cache"]],
+        mask=F.pad(batch["mask"], (extra, 0)),
+        ids=F.pad(batch["ids"], (extra, 0), value=pad_id),
+    )
+
+
+def _merge(a, b, pad_id):
+    """Concatenate two batches along the batch dimension."""
+    if a is None or b is None:
+        return b if a is None else a
+    length = max(a["mask"].shape[1], b["mask"].shape[1])
+    a, b = _pad_left(a, length, pad_id), _pad_left(b, length, pad_id)
+    return {
+        "cache": [(torch.cat([ka, kb]), torch.cat([va, vb]))
+                  for (ka, va), (kb, vb) in zip(a["cache"], b["cache"])],
+        "mask": torch.cat([a["mask"], b["mask"]]),
+        "ids": torch.cat([a["ids"], b["ids"]]),
+        "rows": a["rows"] + b["rows"],
+        "out": a["out"] + b["out"],
+    }
+
+
+def _select(batch, keep):
+    """Keep the given batch rows and drop padding columns no row needs."""
+    if not keep:
+        return None
+    index = torch.tensor(keep, device=batch["mask"].device)
+    mask = batch["mask"][index]
+    start = int((mask.sum(0) > 0).nonzero()[0])
+    return {
+        "cache": [(k[index.to(k.device), :, start:], v[index.to(v.device), :, start:])
+                  for k, v in batch["cache"]],
+        "mask": mask[:, start:],
+        "ids": batch["ids"][index][:, start:],
+        "rows": [batch["rows"][i] for i in keep],
+        "out": [batch["out"][i] for i in keep],
+    }
+
+
+def _chunks(prompts):
+    """Iterate over prompt chunks; a plain list of token id lists is one chunk."""
+    if isinstance(prompts, list):
+        return iter([prompts] if prompts else [])
+    return iter(prompts)
+
+
+def tokenize_in_background(tokenizer, texts, chunk_size, depth=2):
+    """
+    Tokenize texts chunk by chunk in a background thread (fast tokenizers
+    release the GIL), yielding lists of token ids while the caller
+    generates. At most `depth` tokenized chunks wait in the queue.
+    """
+    ready = queue.Queue(maxsize=depth)
+
+    def produce():
+        try:
+            for start in range(0, len(texts), chunk_size):
+                ready.put(tokenizer(texts[start:start + chunk_size], add_special_tokens=False)["input_ids"])
+        except Exception as e:
+            ready.put(e)
+        ready.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while (chunk := ready.get()) is not None:
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+def _prefill_prefix(model, prefix, device):
+    """Run the shared prompt prefix once; returns its (ids, per-layer cache)."""
+    ids = torch.tensor([prefix], dtype=torch.long, device=device)
+    out = model(input_ids=ids, use_cache=True, logits_to_keep=1)
+    return ids, list(out.past_key_values.to_legacy_cache())
+
+
+def _prefill(model, prompts, rows, pad_id, device, shared=None):
+    """
+    Run the prompts of newly admitted rows (left-padded) through the model.
+    With a prefilled shared prefix, only the per-row suffixes are computed:
+    the batch is laid out as [prefix | padding | suffix] on top of the
+    prefix cache.
+    """
+    length = max(len(p) for p in prompts)
+    ids = torch.full((len(prompts), length), pad_id, dtype=torch.long, device=device)
+    mask = torch.zeros((len(prompts), length), dtype=torch.long, device=device)
+    for i, p in enumerate(prompts):
+        ids[i, length - len(p):] = torch.tensor(p, device=device)
+        mask[i, length - len(p):] = 1
+
+    past = None
+    if shared is not None:
+        prefix_ids, prefix_cache = shared
+        n = len(prompts)
+        past = DynamicCache.from_legacy_cache(tuple(
+            (k.expand(n, -1, -1, -1), v.expand(n, -1, -1, -1)) for k, v in prefix_cache
+        ))
+        ids = torch.cat([prefix_ids.expand(n, -1), ids], dim=1)
+        mask = torch.cat([torch.ones_like(prefix_ids).expand(n, -1), mask], dim=1)
+
+    positions = (mask.cumsum(-1) - 1).clamp(min=0)
+    out = model(input_ids=ids[:, -length:], attention_mask=mask, position_ids=positions[:, -length:],
+                past_key_values=past, use_cache=True, logits_to_keep=1)
+    batch = {"cache": list(out.past_key_values.to_legacy_cache()), "mask": mask, "ids": ids,
+             "rows": list(rows), "out": [[] for _ in rows]}
+    return batch, out.logits[:, -1, :]
+
+
+def _decode(model, batch):
+    """Feed every row its last sampled token; returns the next-token logits."""
+    mask = batch["mask"]
+    positions = mask.sum(-1, keepdim=True) - 1
+    out = model(input_ids=batch["ids"][:, -1:], attention_mask=mask, position_ids=positions,
+                past_key_values=DynamicCache.from_legacy_cache(tuple(batch["cache"])),
+                use_cache=True)
+    batch["cache"] = list(out.past_key_values.to_legacy_cache())
+    return out.logits[:, -1, :]
+
+
+def _sample(batch, logits, processors, do_sample, eos, max_new_tokens):
+    """
+    Pick the next token of every row and append it to ids/mask. Returns the
+    positions of rows that are still generating.
+    """
+    scores = processors(batch["ids"], logits.float())
+    if do_sample:
+        tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)
+    else:
+        tokens = scores.argmax(dim=-1, keepdim=True)
+    tokens = tokens.to(batch["ids"].device)
+
+    batch["ids"] = torch.cat([batch["ids"], tokens], dim=1)
+    batch["mask"] = F.pad(batch["mask"], (0, 1), value=1)
+
+    running = []
+    for i, token in enumerate(tokens[:, 0].tolist()):
+        batch["out"][i].append(token)
+        if token not in eos and len(batch["out"][i]) < max_new_tokens:
+            running.append(i)
+    return running
+
+
+@torch.inference_mode()
+def generate_continuous(model, tokenizer, prompts, max_batch_size, max_new_tokens,
+                        do_sample=True, temperature=0.2, top_p=0.9, top_k=50,
+                        refill_fraction=0.125, prefix=None, progress=None, on_result=None):
+    """
+    Generate completions for tokenized prompts with continuous batching.
+
+    Prompts are admitted shortest-first (length-sorted bucketing), up to
+    max_batch_size running at once. Finished sequences leave the batch
+    immediately and, once at least refill_fraction of the slots are free,
+    waiting prompts are prefilled and merged into the running batch.
+    prompts is a list of token id lists, or an iterable of such lists
+    (chunks, e.g. from tokenize_in_background); the next chunk is pulled
+    whenever fewer than max_batch_size prompts are waiting.
+    Returns the generated token ids of every prompt, in input order.
+    prefix, if given, is a token id list shared by every prompt (prompts then
+    hold only the per-row suffix): it is prefilled once and its KV cache is
+    reused for every admitted row.
+    progress, if given, is a tqdm-like bar advanced once per finished prompt;
+    on_result(prompt index, token ids), if given, is called as each finishes.
+    """
+    device = model.device
+    pad_id = tokenizer.pad_token_id
+    eos = _eos_ids(model, tokenizer)
+    processors = _logits_processors(model, do_sample, temperature, top_k, top_p)
+    refill_min = max(1, int(max_batch_size * refill_fraction))
+    shared = _prefill_prefix(model, prefix, device) if prefix else None
+
+    chunks = _chunks(prompts)
+    prompts, results = [], []
+    waiting = deque()
+    batch = None
+    generated, start = 0, time.perf_counter()
+
+    def pull():
+        """Append the next chunk to the waiting queue; False once exhausted."""
+        nonlocal waiting
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        first = len(prompts)
+        prompts.extend(chunk)
+        results.extend([None] * len(chunk))
+        waiting = deque(sorted([*waiting, *range(first, len(prompts))], key=lambda i: len(prompts[i])))
+        return True
+
+    more = pull()
+
+    def retire(batch, running):
+        for i, row in enumerate(batch["rows"]):
+            if i not in running:
+                results[row] = batch["out"][i]
+                if on_result is not None:
+                    on_result(row, results[row])
+                if progress is not None:
+                    progress.update(1)
+        return _select(batch, sorted(running))
+
+    while waiting or more or batch is not None:
+        while more and len(waiting) < max_batch_size:
+            more = pull()
+        active = 0 if batch is None else len(batch["rows"])
+        free = max_batch_size - active
+        if waiting and (active == 0 or free >= refill_min):
+            rows = [waiting.popleft() for _ in range(min(free, len(waiting)))]
+            new, logits = _prefill(model, [prompts[r] for r in rows], rows, pad_id, device, shared)
+            running = set(_sample(new, logits, processors, do_sample, eos, max_new_tokens))
+            generated += len(rows)
+            batch = _merge(batch, retire(new, running), pad_id)
+            continue
+
+        logits = _decode(model, batch)
+        running = set(_sample(batch, logits, processors, do_sample, eos, max_new_tokens))
+        generated += len(batch["rows"])
+        batch = retire(batch, running)
+
+        if progress is not None:
+            progress.set_postfix(tok_s=f"{generated / (time.perf_counter() - start):.1f}")
+
+    return results
+
+
+# ------------------------------------------------------
+# Constrained label decoding
+# ------------------------------------------------------
+def _label_trie(label_ids):
+    """Prefix tree {token: subtree} of label token sequences; leaves map None to the label index."""
+    trie = {}
+    for i, ids in enumerate(label_ids):
+        node = trie
+        for token in ids:
+            if None in node:
+                raise ValueError("a label must not be a token prefix of another label")
+            node = node.setdefault(token, {})
+        if node:
+            raise ValueError("a label must not be a token prefix of another label")
+        node[None] = i
+    return trie
+
+
+@torch.inference_mode()
+def classify_constrained(model, tokenizer, prompts, labels, batch_size, prefix=None, progress=None,
+                         on_result=None):
+    """
+    Pick one of `labels` for every tokenized prompt by greedy decoding
+    restricted to the label token sequences. When the labels start with
+    distinct tokens this is a single forward pass per batch.
+    prompts is a list of token id lists or an iterable of chunks, as for
+    generate_continuous(); batches are length-sorted within each chunk.
+    Returns (label index, probability) per prompt, in input order; the
+    probability multiplies the step probabilities renormalized over the
+    allowed tokens.
+    progress, if given, is a tqdm-like bar advanced once per prompt;
+    on_result(prompt index, (label index, probability)), if given, is called
+    after every batch.
+    """
+    device = model.device
+    pad_id = tokenizer.pad_token_id
+    trie = _label_trie([tokenizer(label, add_special_tokens=False)["input_ids"] for label in labels])
+    shared = _prefill_prefix(model, prefix, device) if prefix else None
+
+    results = []
+    for chunk in _chunks(prompts):
+        first = len(results)
+        results.extend([None] * len(chunk))
+        order = sorted(range(len(chunk)), key=lambda i: len(chunk[i]))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            batch, logits = _prefill(model, [chunk[r] for r in rows], rows, pad_id, device, shared)
+            nodes = [trie] * len(rows)
+            probs = [1.0] * len(rows)
+
+            while True:
+                tokens = []
+                for i, node in enumerate(nodes):
+                    if None in node:
+                        tokens.append(pad_id)
+                        continue
+                    allowed = list(node)
+                    step = torch.softmax(logits[i, allowed].float(), dim=-1)
+                    best = int(step.argmax())
+                    probs[i] *= float(step[best])
+                    node = tail = node[allowed[best]]
+                    # Once a single label remains its tokens are forced: skip them
+                    while None not in tail and len(tail) == 1:
+                        tail = next(iter(tail.values()))
+                    nodes[i] = tail if None in tail else node
+                    tokens.append(allowed[best])
+                if all(None in node for node in nodes):
+                    break
+                # Some label continues past its first token: feed the chosen tokens
+                batch["ids"] = torch.cat([batch["ids"], torch.tensor(tokens, device=device)[:, None]], dim=1)
+                batch["mask"] = F.pad(batch["mask"], (0, 1), value=1)
+                logits = _decode(model, batch)
+
+            for row, node, p in zip(rows, nodes, probs):
+                results[first + row] = (node[None], p)
+                if on_result is not None:
+                    on_result(first + row, results[first + row])
+            if progress is not None:
+                progress.update(len(rows))
+    return results
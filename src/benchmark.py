@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import subprocess
+from synthetic_maildir import CONFIG_FILE, generate_maildir, scaled
+
+# ------------------------------------------------------
+# Paths
+# ------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(BASE_DIR, "src")
+BENCH_DIR = os.path.join(BASE_DIR, "bench")
+REPORT_DIR = os.path.join(BASE_DIR, "results", "benchmarks")
+
+# ------------------------------------------------------
+# End-to-end benchmark on synthetic maildirs
+# ------------------------------------------------------
+# Every scale gets a project directory bench/<scale>x/ holding a synthetic
+# maildir/ and a fresh copy of src/. The scripts derive their paths from
+# their own location, so they read and write inside that directory. (A
+# symlink would not do: imported modules resolve to the real src/.)
+# Each run starts from an empty data/ and results/ and goes through
+# pipeline.py, one stage at a time. The stage reports (profiling.py) are
+# then collected into one JSON file.
+SCALES = (1, 10, 100)
+# Plotting stages and their upstream stages (index, extract, email_matrix,
+# analyze_matrix); the LLM stages are not benchmarked
+TARGETS = ("email_stats", "analyze_results")
+# Throughput shown next to a pipeline stage: (script report, step, field)
+HIGHLIGHTS = {
+    "index": ("maildir_index", "parse", "files_per_s"),
+    "email_matrix": ("email_matrix", "matrix", "edges_per_s"),
+}
+# Steps of analyze_matrix.py listed with their own times
+METRICS = ("betweenness", "closeness", "pagerank", "eigenvector", "communities")
+
+
+def prepare(scale, overrides, regenerate=False):
+    """Create (or reuse) the project directory of one scale; returns its path."""
+    project = os.path.join(BENCH_DIR, f"{scale:g}x")
+    params = scaled(scale, **overrides)
+    config = os.path.join(project, CONFIG_FILE)
+    if not regenerate and os.path.exists(config):
+        with open(config, "r") as f:
+            if json.load(f) == params:
+                return project, None
+
+    shutil.rmtree(project, ignore_errors=True)
+    os.makedirs(project)
+    start = time.perf_counter()
+    messages, n_bytes = generate_maildir(project, **params)
+    seconds = time.perf_counter() - start
+    print(f"[{scale:g}x] generated {messages} messages ({n_bytes / 2**20:.1f} MiB) in {seconds:.1f}s")
+    return project, seconds
+
+
+def run_scale(scale, overrides, workers=1, regenerate=False):
+    """Run the pipeline on one scale; returns its benchmark record."""
+    project, gen_seconds = prepare(scale, overrides, regenerate)
+    for name in ("data", "results", "src"):
+        shutil.rmtree(os.path.join(project, name), ignore_errors=True)
+    shutil.copytree(SRC_DIR, os.path.join(project, "src"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+
+    run = f"bench-{scale:g}x"
+    env = dict(os.environ, ENRON_PROFILE_RUN=run, MPLBACKEND="Agg")
+    command = [sys.executable, os.path.join("src", "pipeline.py"), *TARGETS, "--force",
+               "--jobs", "1", "--workers", str(workers)]
+    print(f"[{scale:g}x] running {' '.join(command[1:])}")
+    start = time.perf_counter()
+    code = subprocess.call(command, cwd=project, env=env)
+    seconds = time.perf_counter() - start
+
+    reports = {}
+    profile_dir = os.path.join(project, "results", "profiles", run)
+    for file in sorted(os.listdir(profile_dir)) if os.path.isdir(profile_dir) else []:
+        with open(os.path.join(profile_dir, file), "r") as f:
+            reports[file[:-len(".json")]] = json.load(f)
+
+    with open(os.path.join(project, CONFIG_FILE), "r") as f:
+        params = json.load(f)
+    return {"scale": scale, "params": params, "exit_code": code, "seconds": round(seconds, 3),
+            "generate_seconds": gen_seconds, "reports": reports}
+
+
+def stage_entry(report, name):
+    return next((s for s in (report or {}).get("stages", []) if s["stage"] == name), None)
+
+
+def highlight(record, name):
+    """Throughput or per-metric times of one pipeline stage, as text."""
+    reports = record["reports"]
+    if name in HIGHLIGHTS:
+        script, step, field = HIGHLIGHTS[name]
+        entry = stage_entry(reports.get(script), step)
+        return f"{field}={entry[field]:.0f}" if entry and entry.get(field) is not None else ""
+    if name == "analyze_matrix":
+        entries = [stage_entry(reports.get(name), metric) for metric in METRICS]
+        return " ".join(f"{e['stage']}={e['seconds']:.2f}s" for e in entries if e)
+    return ""
+
+
+def summarize(records):
+    """
+    Print stage time, messages/s and peak RSS per scale, plus the scaling
+    exponent of each stage's time against the smallest scale (1 = linear).
+    """
+    base = records[0]
+    print(f"\n{'stage':<16}{'scale':>7}{'seconds':>10}{'msgs/s':>12}{'peak MiB':>10}"
+          f"{'exponent':>10}  details")
+    for first in base["reports"].get("pipeline", {}).get("stages", []):
+        name = first["stage"]
+        for record in records:
+            entry = stage_entry(record["reports"].get("pipeline"), name)
+            if entry is None or not entry["seconds"]:
+                continue
+            exponent = ""
+            if record is not base and first["seconds"]:
+                exponent = f"{math.log(entry['seconds'] / first['seconds']) / math.log(record['scale'] / base['scale']):.2f}"
+            print(f"{name:<16}{record['scale']:>6g}x{entry['seconds']:>10.2f}"
+                  f"{record['params']['messages'] / entry['seconds']:>12.0f}"
+                  f"{entry.get('peak_rss_mb', 0):>10.1f}{exponent:>10}  {highlight(record, name)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on synthetic maildirs.")
+    parser.add_argument("--scales", nargs="+", type=float, default=list(SCALES),
+                        help="corpus sizes relative to the 5000-message base (default: 1 10 100)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes passed to stages that support --workers")
+    parser.add_argument("--regenerate", action="store_true",
+                        help="rewrite the synthetic maildirs even if they match the parameters")
+    parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    args = parser.parse_args()
+
+    records = []
+    for scale in sorted(args.scales):
+        records.append(run_scale(scale, {"seed": args.seed}, args.workers, args.regenerate))
+        if records[-1]["exit_code"] != 0:
+            print(f"[{scale:g}x] pipeline failed; see bench/{scale:g}x/results/logs/")
+            break
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    path = os.path.join(REPORT_DIR, f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump({"workers": args.workers, "records": records}, f, indent=2)
+    summarize(records)
+    print(f"\nBenchmark report: {path}")
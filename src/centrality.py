@@ -0,0 +1,323 @@
+import random
+import heapq
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+from concurrent.futures import ProcessPoolExecutor
+
+# --------------------------------
+# Centrality engine on CSR adjacency arrays
+# --------------------------------
+# Worker processes receive the CSR arrays once through the pool initializer.
+# The Dijkstra loop indexes plain Python lists (much faster than numpy
+# scalars), converted lazily once per process.
+_GRAPH = None
+_GRAPH_LISTS = None
+
+
+def _init_graph(indptr, indices, weights):
+    global _GRAPH, _GRAPH_LISTS
+    _GRAPH = (indptr, indices, weights)
+    _GRAPH_LISTS = None
+
+
+def _graph_lists():
+    global _GRAPH_LISTS
+    if _GRAPH_LISTS is None:
+        _GRAPH_LISTS = tuple(a.tolist() for a in _GRAPH)
+    return _GRAPH_LISTS
+
+
+def _brandes_source(s, n):
+    """
+    Single-source weighted Brandes step (Dijkstra + dependency
+    accumulation). Returns {node: dependency of s on node}.
+    Edge weights are used as distances, as networkx does with weight=.
+    """
+    indptr, indices, weights = _graph_lists()
+
+    # Dijkstra, counting shortest paths (sigma) and predecessors
+    S = []
+    P = {s: []}
+    sigma = {s: 1.0}
+    D = {}
+    seen = {s: 0.0}
+    count = 1
+    Q = [(0.0, 0, s, s)]
+    while Q:
+        dist, _, pred, v = heapq.heappop(Q)
+        if v in D:
+            continue
+        sigma[v] += sigma[pred] if pred != v else 0.0
+        S.append(v)
+        D[v] = dist
+        for j in range(indptr[v], indptr[v + 1]):
+            w = indices[j]
+            vw_dist = dist + weights[j]
+            if w not in D and (w not in seen or vw_dist < seen[w]):
+                seen[w] = vw_dist
+                heapq.heappush(Q, (vw_dist, count, v, w))
+                count += 1
+                sigma[w] = 0.0
+                P[w] = [v]
+            elif vw_dist == seen[w]:
+                sigma[w] += sigma[v]
+                P[w].append(v)
+
+    # Accumulate dependencies in reverse order of distance
+    delta = dict.fromkeys(S, 0.0)
+    while S:
+        w = S.pop()
+        coeff = (1.0 + delta[w]) / sigma[w]
+        for v in P[w]:
+            delta[v] += sigma[v] * coeff
+    delta[s] = 0.0
+    return delta
+
+
+def _betweenness_batch(sources, n):
+    """Worker task: summed dependencies for a batch of sources."""
+    total = np.zeros(n)
+    for s in sources:
+        for v, d in _brandes_source(s, n).items():
+            total[v] += d
+    return total
+
+
+def _run_batches(A, task, sources, workers, batch_size, *args):
+    """
+    Split sources into batches and sum task() results (arrays of any one
+    shape), in parallel if asked.
+    """
+    n = A.shape[0]
+    batches = [sources[i:i + batch_size] for i in range(0, len(sources), batch_size)]
+    A = A.tocsr()
+    graph = (A.indptr, A.indices, A.data.astype(float))
+    total = np.zeros(n)
+
+    if workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_graph,
+                                 initargs=graph) as pool:
+            for part in pool.map(task, batches, *[[a] * len(batches) for a in args]):
+                total = total + part
+    else:
+        _init_graph(*graph)
+        for batch in batches:
+            total = total + task(batch, *args)
+    return total
+
+
+def betweenness_centrality(A, k=None, seed=123, normalized=True, workers=1, batch_size=64):
+    """
+    Weighted betweenness of the undirected graph with symmetric CSR
+    adjacency A. k=None (or k >= n) is exact; otherwise k sources are
+    sampled with random.Random(seed), matching networkx's choice and
+    rescaling for the same seed. Source batches run across `workers`
+    processes.
+    """
+    n = A.shape[0]
+    if k is None or k >= n:
+        sources = list(range(n))
+    else:
+        sources = random.Random(seed).sample(range(n), k)
+
+    betweenness = _run_batches(A, _betweenness_batch, sources, workers, batch_size, n)
+
+    # Same rescaling as networkx (endpoints excluded)
+    N = n - 1
+    if N < 2:
+        return betweenness
+    K = len(sources)
+    if normalized:
+        scale_source = 1 / ((K - 1) * (N - 1)) if K > 1 else np.nan
+        scale_other = 1 / (K * (N - 1))
+    else:
+        scale_source = N / ((K - 1) * 2) if K > 1 else np.nan
+        scale_other = N / (K * 2)
+    if K == n:
+        return betweenness * scale_source
+    scale = np.full(n, scale_other)
+    scale[sources] = scale_source
+    return betweenness * scale
+
+
+# --------------------------------
+# Vectorized metrics
+# --------------------------------
+def threshold_edges(W, min_weight):
+    """
+    Drop edges lighter than min_weight (vectorized mask on the CSR data).
+    Only the kept entries are copied, so W may be memory-mapped.
+    """
+    W = W.tocsr()
+    keep = np.asarray(W.data) >= min_weight
+    kept_before = np.concatenate(([0], np.cumsum(keep)))
+    indptr = kept_before[np.asarray(W.indptr)]
+    return sp.csr_array((np.asarray(W.data)[keep].astype(float), np.asarray(W.indices)[keep], indptr),
+                        shape=W.shape)
+
+
+def weighted_degree(A):
+    """Weighted degree of the symmetric adjacency A (self-loops count twice)."""
+    return np.asarray(A.sum(axis=1)).ravel() + A.diagonal()
+
+
+def pagerank(A, alpha=0.85, max_iter=100, tol=1.0e-6):
+    """
+    Weighted PageRank by sparse power iteration, following networkx:
+    uniform teleport, dangling mass spread uniformly, L1 convergence test.
+    """
+    n = A.shape[0]
+    out = np.asarray(A.sum(axis=1)).ravel()
+    inv = np.divide(1.0, out, out=np.zeros(n), where=out != 0)
+    Q = (sp.diags_array(inv) @ A).tocsr()
+    dangling = out == 0
+
+    x = np.full(n, 1.0 / n)
+    p = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        xlast = x
+        x = alpha * (Q.T @ x + x[dangling].sum() * p) + (1 - alpha) * p
+        if np.abs(x - xlast).sum() < n * tol:
+            return x
+    raise RuntimeError(f"PageRank failed to converge in {max_iter} iterations")
+
+
+def eigenvector_centrality(A, max_iter=100, tol=1.0e-6):
+    """
+    Eigenvector centrality by power iteration on (A + I), as networkx does,
+    normalized to unit L2 norm.
+    """
+    n = A.shape[0]
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        xlast = x
+        x = xlast + A.T @ xlast
+        norm = np.linalg.norm(x) or 1
+        x = x / norm
+        if np.abs(x - xlast).sum() < n * tol:
+            return x
+    raise RuntimeError(f"Eigenvector centrality failed to converge in {max_iter} iterations")
+
+
+# --------------------------------
+# Closeness and harmonic centrality
+# --------------------------------
+# Exact values need a BFS from every node. With pivot sampling (Eppstein &
+# Wang), a BFS is run from at most k pivots per connected component, and
+# each node's mean distance to the rest of its component is estimated from
+# its distances to the pivots. Pivots get exact values from their own BFS,
+# and components with at most k nodes are computed exactly.
+# Confidence level of the reported per-node error bounds
+CONFIDENCE = 0.95
+
+
+def _pivot_batch(sources, n):
+    """
+    Worker task: BFS from a batch of pivots. Returns a (5, n) array: summed
+    distances and inverse distances from the pivots to every node, then,
+    at each pivot's own position, its exact closeness, exact harmonic
+    centrality and eccentricity.
+    """
+    indptr, indices, weights = _GRAPH
+    A = sp.csr_array((weights, indices, indptr), shape=(n, n))
+    dist = csgraph.shortest_path(A, directed=False, unweighted=True, indices=sources)
+    reached = np.isfinite(dist) & (dist > 0)
+    dist = np.where(reached, dist, 0)
+    inverse = np.divide(1.0, dist, out=np.zeros_like(dist), where=reached)
+
+    part = np.zeros((5, n))
+    part[0] = dist.sum(axis=0)
+    part[1] = inverse.sum(axis=0)
+    reachable = reached.sum(axis=1)
+    total = dist.sum(axis=1)
+    ok = total > 0
+    # Wasserman–Faust scaling for disconnected graphs, as in networkx
+    part[2, sources[ok]] = reachable[ok] / total[ok] * reachable[ok] / (n - 1)
+    part[3, sources] = inverse.sum(axis=1)
+    part[4, sources] = dist.max(axis=1)
+    return part
+
+
+def pivot_count(epsilon, confidence=CONFIDENCE):
+    """
+    Pivots per component for which each node's estimated mean distance is
+    within epsilon × the component diameter of the true one, at the given
+    confidence (Hoeffding bound).
+    """
+    return int(np.ceil(np.log(2 / (1 - confidence)) / (2 * epsilon ** 2)))
+
+
+def pick_pivots(labels, k, seed=123):
+    """Up to k random nodes of every connected component with more than one node."""
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(labels))
+    order = order[np.argsort(labels[order], kind="stable")]
+    sizes = np.bincount(labels)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    rank = np.arange(len(order)) - starts[labels[order]]
+    keep = (rank < k) & (sizes[labels[order]] > 1)
+    return np.sort(order[keep])
+
+
+def closeness_harmonic(A, k=None, epsilon=None, seed=123, workers=1, batch_size=None,
+                       confidence=CONFIDENCE):
+    """
+    Unweighted closeness (Wasserman–Faust scaled, as networkx) and harmonic
+    centrality of the undirected graph with symmetric CSR adjacency A.
+    k pivots per connected component are sampled, or as many as
+    pivot_count(epsilon) needs; with neither, every node is a pivot and
+    the values are exact. Returns {"closeness", "harmonic",
+    "closeness_error", "harmonic_error"}; an error is the largest distance
+    from the estimate to the bounds of its confidence interval (0 when
+    exact). Pivot batches run across `workers` processes.
+    """
+    n = A.shape[0]
+    if k is None and epsilon is not None:
+        k = pivot_count(epsilon, confidence)
+    _, labels = csgraph.connected_components(A, directed=False)
+    pivots = pick_pivots(labels, n if k is None else k, seed)
+    if n < 2 or len(pivots) == 0:
+        # No edges: every node is isolated
+        return {name: np.zeros(n) for name in
+                ("closeness", "harmonic", "closeness_error", "harmonic_error")}
+    batch_size = batch_size or max(1, 2 ** 24 // n)
+    sum_dist, sum_inverse, closeness, harmonic, eccentricity = _run_batches(
+        A, _pivot_batch, pivots, workers, batch_size, n)
+    closeness_error, harmonic_error = np.zeros(n), np.zeros(n)
+
+    # Non-pivots: estimate from the pivots of their component
+    is_pivot = np.zeros(n, dtype=bool)
+    is_pivot[pivots] = True
+    sizes = np.bincount(labels)
+    sampled = np.bincount(labels[pivots], minlength=len(sizes))
+    est = np.flatnonzero(~is_pivot & (sampled[labels] > 0))
+    if len(est):
+        others = sizes[labels[est]] - 1
+        m = sampled[labels[est]]
+        mean_dist = sum_dist[est] / m
+        closeness[est] = others / (n - 1) / mean_dist
+        harmonic[est] = others * sum_inverse[est] / m
+
+        # Distances lie in [1, D]; the diameter D is at most twice any
+        # pivot's eccentricity. Hoeffding bound for sampling without
+        # replacement (Bardenet & Maillard), which vanishes when m = others.
+        min_ecc = np.full(len(sizes), np.inf)
+        np.minimum.at(min_ecc, labels[pivots], eccentricity[pivots])
+        diameter = np.minimum(2 * min_ecc[labels[est]], others)
+        rho = np.minimum(1 - (m - 1) / others, (1 - m / others) * (1 + 1 / m))
+        width = np.sqrt(rho * np.log(2 / (1 - confidence)) / (2 * m))
+        low = np.maximum(mean_dist - (diameter - 1) * width, 1)
+        closeness_error[est] = others / (n - 1) / low - closeness[est]
+        harmonic_error[est] = others * (1 - 1 / diameter) * width
+    return {"closeness": closeness, "harmonic": harmonic,
+            "closeness_error": closeness_error, "harmonic_error": harmonic_error}
+
+
+def closeness_centrality(A, workers=1, batch_size=None):
+    """
+    Exact unweighted closeness of every node via BFS from each source on
+    the CSR structure. Sources are processed in batches (each batch holds a
+    batch × n distance block) and spread across `workers` processes.
+    """
+    return closeness_harmonic(A, workers=workers, batch_size=batch_size)["closeness"]
@@ -1,15 +1,20 @@
 import os
-import torch
+import argparse
 import pandas as pd
 from tqdm import tqdm
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from backends import HFBackend, OpenAIBackend, prompt_hash
+from profiling import stage, write_report
+from role_rules import apply_rules, merge_tiers
 
 # ------------------------------------------------------
 # Paths
 # ------------------------------------------------------
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATASET_FILE = os.path.join(BASE_DIR, "results", "final_dataset", "enron_node_dataset.csv")
+DATASET_FILE = os.path.join(BASE_DIR, "results", "final_dataset", "enron_node_dataset.parquet")
 RESULT_DIR = os.path.join(BASE_DIR, "results", "LLM")
+# Every classified row is appended here as soon as its batch finishes
+CACHE_FILE = os.path.join(RESULT_DIR, "role_cache.csv")
+CACHE_COLUMNS = ["model", "mode", "prompt_hash", "email", "role", "role_confidence"]
 
 os.makedirs(RESULT_DIR, exist_ok=True)
 
@@ -17,22 +22,39 @@ os.makedirs(RESULT_DIR, exist_ok=True)
 # Parameters
 # ------------------------------------------------------
 MODEL_NAME = "Qwen/Qwen2.5-7B-Instruct"
-BATCH_SIZE = 512   
+BATCH_SIZE = 512   # maximum number of sequences generating at once
 MAX_NEW_TOKENS = 128
+# OpenAI-compatible server backend
+SERVER_URL = "http://localhost:8000/v1"
+CONCURRENCY = 64   # requests in flight
+# "generate" samples a free-text answer; "score" picks the role label by
+# constrained decoding (deterministic, one forward pass per batch)
+MODES = ("generate", "score")
+
+ROLES = (
+    "Executive/Leader",
+    "Coordinator",
+    "Bridge/Broker",
+    "Community Hub",
+    "Peripheral Node",
+)
 
 
 # ------------------------------------------------------
 # Load Model + Tokenizer (multi-GPU)
 # ------------------------------------------------------
-def load_qwen_model():
-    print(f"Loading Qwen model: {MODEL_NAME}")
+def load_qwen_model(model_name=MODEL_NAME):
+    # Imported here: the openai backend never needs torch/transformers
+    from transformers import AutoModelForCausalLM, AutoTokenizer
 
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, padding_side="left")
+    print(f"Loading Qwen model: {model_name}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
     tokenizer.pad_token = tokenizer.eos_token  
 
     # Spread across 4× A6000 GPUs
     model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME,
+        model_name,
         torch_dtype="auto",
         device_map="auto",        # multi-GPU sharding
         low_cpu_mem_usage=True
@@ -44,8 +66,13 @@ def load_qwen_model():
 # ------------------------------------------------------
 # Build Qwen prompt
 # ------------------------------------------------------
-def make_prompt(row):
-    return f"""
+SYSTEM_PROMPT = "You classify employees based on social network behavior."
+
+# Shared by every employee; the per-row metrics come last so that the
+# tokens up to here form a common prefix whose KV cache is computed once.
+# It ends with the blank line: BPE keeps ":\n\n" as one token, so the seam
+# must not fall inside it.
+INSTRUCTIONS = """
 You are an expert in organizational network analysis.
 
 Classify this employee into EXACTLY one structural role based on network metrics.
@@ -56,16 +83,6 @@ Possible roles:
 - Community Hub
 - Peripheral Node
 
-Use ONLY the following statistical network measures:
-
-Email: {row['email']}
-Degree Centrality: {row['degree']}
-Betweenness Centrality: {row['betweenness']}
-Closeness Centrality: {row['closeness']}
-PageRank: {row['pagerank']}
-Eigenvector Centrality: {row['eigenvector']}
-Community Assignment: {row['community']}
-
 Guidelines:
 - High degree + high PageRank + high eigenvector → Executive/Leader
 - High betweenness → Bridge/Broker
@@ -75,65 +92,125 @@ Guidelines:
 
 Respond in EXACTLY this format:
 <role>: <one-sentence explanation>
+
+Use ONLY the following statistical network measures:
+
 """
 
 
+# Per-row metric lines, after the instructions: (label, dataset column)
+METRIC_LINES = [
+    ("Email", "email"),
+    ("Degree Centrality", "degree"),
+    ("Betweenness Centrality", "betweenness"),
+    ("Closeness Centrality", "closeness"),
+    ("PageRank", "pagerank"),
+    ("Eigenvector Centrality", "eigenvector"),
+    ("Community Assignment", "community"),
+]
 
+
+def make_prompt(row):
+    return INSTRUCTIONS + "".join(f"{label}: {row[column]}\n" for label, column in METRIC_LINES)
+
+
+def metric_blocks(df):
+    """The metric lines of make_prompt() for every row, built column-wise."""
+    blocks = pd.Series("", index=df.index)
+    for label, column in METRIC_LINES:
+        blocks += f"{label}: " + df[column].map(str) + "\n"
+    return blocks.tolist()
+
+
+# ------------------------------------------------------
+# Result cache (checkpoint)
 # ------------------------------------------------------
-# Apply batching + tqdm + correct Qwen decoding
+def load_cache(model_name, mode, path=CACHE_FILE):
+    """Cached {prompt hash: (role, confidence)} for this model and mode."""
+    if not os.path.exists(path):
+        return {}
+    cache = pd.read_csv(path, keep_default_na=False, float_precision="round_trip")
+    cache = cache[(cache["model"] == model_name) & (cache["mode"] == mode)]
+    confidence = pd.to_numeric(cache["role_confidence"], errors="coerce")
+    return dict(zip(cache["prompt_hash"], zip(cache["role"].astype(str), confidence)))
+
+
+def append_cache(records, path=CACHE_FILE):
+    """Append finished rows with a single write, so a crash never leaves half a batch."""
+    if not records:
+        return
+    text = pd.DataFrame(records, columns=CACHE_COLUMNS).to_csv(
+        index=False, header=not os.path.exists(path))
+    with open(path, "a") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ------------------------------------------------------
+# Continuous batching + tqdm + correct Qwen decoding
 # ------------------------------------------------------
-def classify_roles(df, model, tokenizer, batch_size=BATCH_SIZE):
+def classify_roles(df, backend, mode="generate", explain=False, resume=False):
+    """
+    Add a `role` column ("<role>: <explanation>") to df using an inference
+    backend (see backends.py).
+    mode="score" picks the role among ROLES by constrained decoding and
+    records its probability in `role_confidence`; the explanation is then
+    only generated, as a second pass, when explain is set.
+    Finished rows are appended to CACHE_FILE batch by batch, keyed on the
+    model name and prompt hash. With resume, rows whose prompt is already
+    cached are not classified again.
+    """
     print("Building prompts...")
-    prompts = []
-
-    # Build all prompts first
-    for _, row in df.iterrows():
-        user_prompt = make_prompt(row)
-        messages = [
-            {"role": "system", "content": "You classify employees based on social network behavior."},
-            {"role": "user", "content": user_prompt},
-        ]
-        chat_text = tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-        prompts.append(chat_text)
-
-    print(f"Total employees: {len(prompts)}")
-
-    roles = []
-
-    # Process in batches with tqdm progress bar
-    for i in tqdm(range(0, len(prompts), batch_size), desc="Classifying"):
-        batch = prompts[i:i + batch_size]
-
-        # Tokenize batch
-        inputs = tokenizer(
-            batch,
-            return_tensors="pt",
-            padding=True,
-            truncation=True
-        ).to(model.device)
-
-        # Generate output for the whole batch
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=MAX_NEW_TOKENS,
-            do_sample=True,
-            temperature=0.2,
-            top_p=0.9,
-            top_k=50
-        )
-
-        # Decode only new tokens
-        for j in range(len(batch)):
-            input_len = inputs["input_ids"].shape[1]
-            out_ids = outputs[j][input_len:]
-            text = tokenizer.decode(out_ids, skip_special_tokens=True).strip()
-            roles.append(text)
-
-    df["role"] = roles
+    blocks = metric_blocks(df)
+    if blocks and INSTRUCTIONS + blocks[0] != make_prompt(df.iloc[0]):
+        raise ValueError("metric_blocks() disagrees with make_prompt()")
+    print(f"Total employees: {len(blocks)}")
+
+    mode = "score+explain" if mode == "score" and explain else mode
+    keys = [prompt_hash(SYSTEM_PROMPT, INSTRUCTIONS + block) for block in blocks]
+    results = load_cache(backend.name, mode) if resume else {}
+    todo = [i for i, key in enumerate(keys) if key not in results]
+    if resume:
+        print(f"Resuming: {len(blocks) - len(todo)} cached, {len(todo)} to classify")
+
+    pending = []
+
+    def record(i, role, confidence=None):
+        results[keys[i]] = (role, confidence)
+        pending.append([backend.name, mode, keys[i], df["email"].iloc[i], role, confidence])
+        if len(pending) >= backend.batch_size:
+            append_cache(pending)
+            pending.clear()
+
+    if todo:
+        todo_blocks = [blocks[i] for i in todo]
+        if mode == "score":
+            with tqdm(total=len(todo), desc="Scoring roles") as progress, stage("score") as counts:
+                backend.score(SYSTEM_PROMPT, INSTRUCTIONS, todo_blocks, ROLES, progress=progress,
+                              on_result=lambda j, r: record(todo[j], f"{r[0]}:", r[1]))
+                counts.update(rows=len(todo), **backend.usage)
+        else:
+            answers, confidence = None, [None] * len(todo)
+            if mode == "score+explain":
+                with tqdm(total=len(todo), desc="Scoring roles") as progress, stage("score") as counts:
+                    scored = backend.score(SYSTEM_PROMPT, INSTRUCTIONS, todo_blocks, ROLES,
+                                           progress=progress)
+                    counts.update(rows=len(todo), **backend.usage)
+                # Explanation pass: continue each answer after the chosen "<role>:"
+                answers = [f"{label}:" for label, _ in scored]
+                confidence = [p for _, p in scored]
+
+            with tqdm(total=len(todo), desc="Classifying") as progress, stage("generate") as counts:
+                backend.generate(SYSTEM_PROMPT, INSTRUCTIONS, todo_blocks, answers=answers,
+                                 progress=progress,
+                                 on_result=lambda j, role: record(todo[j], role, confidence[j]))
+                counts.update(rows=len(todo), **backend.usage)
+        append_cache(pending)
+
+    df["role"] = [results[key][0] for key in keys]
+    if mode.startswith("score"):
+        df["role_confidence"] = [results[key][1] for key in keys]
     return df
 
 
@@ -150,17 +227,56 @@ def save_results(df):
 # MAIN
 # ------------------------------------------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify employee roles with Qwen.")
+    parser.add_argument("--model", default=MODEL_NAME,
+                        help="Hugging Face model name or local path, or the served model name "
+                             "with --backend openai (default: Qwen2.5-7B-Instruct)")
+    parser.add_argument("--backend", choices=("hf", "openai"), default="hf",
+                        help="run the model in-process (hf) or query an OpenAI-compatible server")
+    parser.add_argument("--server-url", default=SERVER_URL,
+                        help=f"base URL of the OpenAI-compatible server (default: {SERVER_URL})")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="maximum requests in flight with --backend openai")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="maximum number of sequences generating at once")
+    parser.add_argument("--mode", choices=MODES, default="generate",
+                        help="generate free text, or score the role labels directly (default: generate)")
+    parser.add_argument("--explain", action="store_true",
+                        help="with --mode score, also generate the one-sentence explanation")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip rows already classified (same model, mode and prompt) in the cache")
+    parser.add_argument("--no-rules", action="store_true",
+                        help="send every row to the LLM instead of pre-assigning obvious Peripheral Nodes")
+    args = parser.parse_args()
+
     print(f"Loading dataset from: {DATASET_FILE}")
-    df = pd.read_csv(DATASET_FILE)
+    df = pd.read_parquet(DATASET_FILE)
     print(f"Loaded {len(df)} employees")
 
-    # Load model
-    model, tokenizer = load_qwen_model()
-
-    # Classify in big batches
-    df = classify_roles(df, model, tokenizer)
+    # Rule tier: obvious Peripheral Nodes never reach the LLM
+    if args.no_rules:
+        ruled, rest = df.iloc[:0], df
+    else:
+        ruled, rest = apply_rules(df)
+    print(f"Rule tier assigned {len(ruled)} Peripheral Nodes; {len(rest)} rows go to the LLM")
+
+    if len(rest):
+        if args.backend == "openai":
+            backend = OpenAIBackend(args.server_url, args.model, concurrency=args.concurrency,
+                                    max_new_tokens=MAX_NEW_TOKENS)
+        else:
+            # Load model; classify with continuous batching (or constrained label scoring)
+            with stage("load_model"):
+                model, tokenizer = load_qwen_model(args.model)
+            backend = HFBackend(model, tokenizer, args.batch_size, MAX_NEW_TOKENS)
+
+        rest = classify_roles(rest, backend, mode=args.mode, explain=args.explain,
+                              resume=args.resume)
+    df = merge_tiers(ruled, rest, df.index)
 
     # Save to CSV
     save_results(df)
+    write_report("classify_roles", backend=args.backend, mode=args.mode, model=args.model,
+                 rows=len(df), ruled=len(ruled))
 
     print("\nDONE! All employees classified by Qwen.")
@@ -1,29 +1,32 @@
 import os
-import re
+import json
+import argparse
 import numpy as np
-from collections import defaultdict
+import scipy.sparse as sp
+from maildir_index import INDEX_DIR, load_delta, load_index, message_pairs, read_generation
+from profiling import stage, write_report
 
 # --------------------------------
 # Paths
 # --------------------------------
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-MAILDIR = os.path.join(BASE_DIR, "maildir")
 EMAIL_LIST_FILE = os.path.join(BASE_DIR, "data", "email_address", "enron_emails.txt")
 RESULT_DIR = os.path.join(BASE_DIR, "data","matrix")
 
-os.makedirs(RESULT_DIR, exist_ok=True)
-
-EMAIL_REGEX = re.compile(r'[\w\.-]+@[\w\.-]+')
+# Each matrix is a directory of CSR arrays (see save_csr)
+MATRIX_DIR = os.path.join(RESULT_DIR, "email_matrix")
+NETWORK_DIR = os.path.join(RESULT_DIR, "network_email_communication")
+# Row/column order and index generation the saved matrices were built from
+USERS_FILE = os.path.join(RESULT_DIR, "matrix_users.txt")
+STATE_FILE = os.path.join(RESULT_DIR, "matrix_state.json")
+TENSOR_FILE = os.path.join(RESULT_DIR, "edge_tensor.npz")
 
+# Time buckets of the edge tensor, as numpy datetime64 units
+BUCKETS = {"week": "W", "month": "M"}
+# Receiver fields weighted separately in the edge tensor
+EDGE_FIELDS = ("to", "cc", "bcc")
 
-def extract_header_field(text, fieldname):
-    """Return set of emails from a header field (From, To, Cc, Bcc)."""
-    pattern = rf"{fieldname}:(.*)"
-    matches = re.findall(pattern, text, flags=re.IGNORECASE)
-    emails = set()
-    for m in matches:
-        emails.update(EMAIL_REGEX.findall(m))
-    return {e.lower() for e in emails}
+os.makedirs(RESULT_DIR, exist_ok=True)
 
 
 def load_enron_emails(path):
@@ -33,41 +36,80 @@ def load_enron_emails(path):
     return sorted(emails)
 
 
-def build_email_matrix(users):
+def user_id_map(index, users):
+    """Map index address ids to matrix rows (-1 for non-internal addresses)."""
+    rows = {email: i for i, email in enumerate(users)}
+    return np.array([rows.get(a, -1) for a in index["addresses"]], dtype=np.int64)
+
+
+def count_pairs(index, users):
+    """Sparse sender→receiver message counts for the messages in index."""
+    N = len(users)
+
+    # internal addresses only
+    senders, receivers = message_pairs(index, "from", "to", user_id_map(index, users))
+
+    # Duplicate (sender, receiver) entries are summed by the CSR conversion
+    counts = np.ones(len(senders), dtype=np.int64)
+    matrix = sp.coo_array((counts, (senders, receivers)), shape=(N, N)).tocsr()
+    matrix.sum_duplicates()
+    return matrix
+
+
+def build_email_matrix(users, index):
     """
-    Build full sender→receiver count matrix from the maildir.
+    Build full sender→receiver count matrix from the maildir index.
     Returns:
-        matrix (NxN numpy array),
+        matrix (NxN scipy.sparse CSR array),
         index_map (dict email→row/column)
     """
     N = len(users)
-    matrix = np.zeros((N, N), dtype=int)
-    index = {email: i for i, email in enumerate(users)}
+    rows = {email: i for i, email in enumerate(users)}
+
+    print(f"Building {N}×{N} sparse email interaction matrix...")
 
-    print(f"Building {N}×{N} email interaction matrix...")
+    return count_pairs(index, users), rows
 
-    for root, _, files in os.walk(MAILDIR):
-        for file in files:
-            fp = os.path.join(root, file)
-            try:
-                with open(fp, "r", errors="ignore") as f:
-                    text = f.read()
-            except:
-                continue
 
-            senders = extract_header_field(text, "From")
-            receivers = extract_header_field(text, "To")
+def save_csr(matrix, path):
+    """
+    Write a CSR matrix as separate indptr/indices/data .npy files under
+    path/, so that load_csr() can memory-map them.
+    """
+    matrix = matrix.tocsr()
+    os.makedirs(path, exist_ok=True)
+    for name in ("indptr", "indices", "data"):
+        np.save(os.path.join(path, f"{name}.npy"), getattr(matrix, name))
+    np.save(os.path.join(path, "shape.npy"), np.array(matrix.shape, dtype=np.int64))
 
-            # internal addresses only
-            senders = [s for s in senders if s in index]
-            receivers = [r for r in receivers if r in index]
 
-            for s in senders:
-                for r in receivers:
-                    if s != r:
-                        matrix[index[s], index[r]] += 1
+def load_csr(path, mmap_mode="r"):
+    """
+    Load a matrix written by save_csr(). With the default mmap_mode the
+    arrays stay on disk and are paged in on access.
+    """
+    arrays = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+              for name in ("data", "indices", "indptr")]
+    shape = tuple(int(d) for d in np.load(os.path.join(path, "shape.npy")))
+    return sp.csr_array(tuple(arrays), shape=shape)
 
-    return matrix, index
+
+def csr_line_sums(matrix, chunk_size=1 << 22):
+    """
+    Row and column sums of a (possibly memory-mapped) CSR matrix, reading
+    at most chunk_size stored entries at a time.
+    """
+    n_rows, n_cols = matrix.shape
+    indptr = np.asarray(matrix.indptr)
+    row_sums = np.zeros(n_rows)
+    col_sums = np.zeros(n_cols)
+    for start in range(0, matrix.nnz, chunk_size):
+        end = min(start + chunk_size, matrix.nnz)
+        data = np.asarray(matrix.data[start:end], dtype=float)
+        rows = np.searchsorted(indptr, np.arange(start, end), side="right") - 1
+        row_sums += np.bincount(rows, weights=data, minlength=n_rows)
+        col_sums += np.bincount(matrix.indices[start:end], weights=data, minlength=n_cols)
+    return row_sums, col_sums
 
 
 def build_symmetric_network_matrix(matrix):
@@ -75,21 +117,231 @@ def build_symmetric_network_matrix(matrix):
     Convert directional matrix to undirected network:
     A_ij = emails(i→j) + emails(j→i)
     """
-    return matrix + matrix.T
+    return (matrix + matrix.T).tocsr()
+
+
+# --------------------------------
+# Time-bucketed edge tensor
+# --------------------------------
+def combine_edges(tensors, signs=None):
+    """
+    Sum edge tensors entry-wise on (period, src, dst), dropping entries whose
+    field weights all cancel to zero. signs optionally negates tensors.
+    """
+    signs = signs or [1] * len(tensors)
+    period = np.concatenate([t["period"] for t in tensors])
+    src = np.concatenate([t["src"] for t in tensors])
+    dst = np.concatenate([t["dst"] for t in tensors])
+    weights = {f: np.concatenate([sign * t[f] for t, sign in zip(tensors, signs)])
+               for f in EDGE_FIELDS}
+
+    order = np.lexsort((dst, src, period))
+    period, src, dst = period[order], src[order], dst[order]
+    starts = np.flatnonzero(np.concatenate((
+        [True], (np.diff(period) != 0) | (np.diff(src) != 0) | (np.diff(dst) != 0)
+    ))) if len(order) else np.zeros(0, dtype=np.int64)
+
+    combined = {"granularity": tensors[0]["granularity"],
+                "period": period[starts], "src": src[starts], "dst": dst[starts]}
+    nonzero = np.zeros(len(starts), dtype=bool)
+    for f in EDGE_FIELDS:
+        w = weights[f][order]
+        combined[f] = np.add.reduceat(w, starts) if len(starts) else w
+        nonzero |= combined[f] != 0
+    for key in ("period", "src", "dst") + EDGE_FIELDS:
+        combined[key] = combined[key][nonzero]
+    return combined
+
+
+def build_edge_tensor(users, index, granularity="month"):
+    """
+    Build a sparse (period × sender × receiver) edge store from the index.
+    Each entry carries one message count per receiver field (To, Cc, Bcc);
+    period is the message date as a numpy datetime64 week/month number.
+    Messages without a readable Date header are left out.
+    """
+    id_map = user_id_map(index, users)
+    unit = BUCKETS[granularity]
+    periods = index["date"].astype(f"datetime64[s]").astype(f"datetime64[{unit}]").astype(np.int64)
+    dated = index["date"] != -1
+
+    parts = []
+    for field in EDGE_FIELDS:
+        messages, src, dst = message_pairs(index, "from", field, id_map, with_messages=True)
+        keep = dated[messages]
+        part = {"granularity": granularity,
+                "period": periods[messages[keep]], "src": src[keep], "dst": dst[keep]}
+        for f in EDGE_FIELDS:
+            part[f] = np.full(int(keep.sum()), int(f == field), dtype=np.int64)
+        parts.append(part)
+    return combine_edges(parts)
+
+
+def save_edge_tensor(tensor, path=TENSOR_FILE):
+    np.savez(path, **tensor)
+    print(f"Saved edge_tensor.npz ({len(tensor['period'])} entries, per-{tensor['granularity']})")
+
+
+def load_edge_tensor(path=TENSOR_FILE):
+    with np.load(path) as data:
+        tensor = {k: data[k] for k in data.files}
+    tensor["granularity"] = str(tensor["granularity"])
+    return tensor
+
+
+def reorder_matrix(matrix, old_users, users):
+    """
+    Re-label a matrix built over old_users onto the users ordering.
+    Returns None if an old user is no longer in the list.
+    """
+    rows = {email: i for i, email in enumerate(users)}
+    perm = np.array([rows.get(u, -1) for u in old_users], dtype=np.int64)
+    if (perm < 0).any():
+        return None
+    coo = matrix.tocoo()
+    N = len(users)
+    return sp.coo_array((coo.data, (perm[coo.row], perm[coo.col])), shape=(N, N)).tocsr()
+
+
+def relabel_matrices(matrix, network, tensor, old_users, users):
+    """
+    Move saved matrices and edge tensor from the old_users ordering onto
+    users. Returns (matrix, network, tensor), or None if an old user is no
+    longer in the list.
+    """
+    if old_users == users:
+        return matrix, network, tensor
+    matrix = reorder_matrix(matrix, old_users, users)
+    network = reorder_matrix(network, old_users, users)
+    if matrix is None:
+        return None
+    rows = {email: i for i, email in enumerate(users)}
+    perm = np.array([rows[u] for u in old_users], dtype=np.int64)
+    return matrix, network, dict(tensor, src=perm[tensor["src"]], dst=perm[tensor["dst"]])
+
+
+def update_email_matrices(matrix, network, tensor, old_users, users, added, removed):
+    """
+    Apply an index delta to saved matrices and edge tensor: counts from added
+    messages are added, counts from removed messages subtracted. Returns
+    (matrix, network, tensor), or None when they must be rebuilt.
+    """
+    relabeled = relabel_matrices(matrix, network, tensor, old_users, users)
+    if relabeled is None:
+        return None
+    matrix, network, tensor = relabeled
+
+    delta = count_pairs(added, users) - count_pairs(removed, users)
+    print(f"Applying delta: {len(added['path'])} added, {len(removed['path'])} removed messages, "
+          f"{delta.nnz} changed entries.")
+
+    matrix = (matrix + delta).tocsr()
+    network = (network + delta + delta.T).tocsr()
+    matrix.eliminate_zeros()
+    network.eliminate_zeros()
+
+    granularity = tensor["granularity"]
+    tensor = combine_edges([tensor,
+                            build_edge_tensor(users, added, granularity),
+                            build_edge_tensor(users, removed, granularity)],
+                           signs=[1, 1, -1])
+    return matrix, network, tensor
+
+
+def load_state():
+    """Return (users, index generation) of the saved matrices, or None."""
+    if not (os.path.exists(STATE_FILE) and os.path.exists(USERS_FILE)):
+        return None
+    with open(STATE_FILE, "r") as f:
+        state = json.load(f)
+    return load_enron_emails(USERS_FILE), state["index_generation"]
+
+
+def save_matrices(matrix, network, tensor, users, generation):
+    save_csr(matrix, MATRIX_DIR)
+    print(f"Saved directional email_matrix/ ({matrix.nnz} nonzero entries)")
+
+    save_csr(network, NETWORK_DIR)
+    print("Saved network_email_communication/")
+
+    save_edge_tensor(tensor, TENSOR_FILE)
+
+    with open(USERS_FILE, "w") as f:
+        for email in users:
+            f.write(email + "\n")
+    with open(STATE_FILE, "w") as f:
+        json.dump({"index_generation": generation}, f)
+
+
+def incremental_update(users, granularity):
+    """
+    Try to move the saved matrices to the current index generation using the
+    index delta. Returns (matrix, network, tensor), or None if a rebuild is
+    needed (also when the saved tensor uses another time bucket).
+    """
+    state = load_state()
+    delta = load_delta(INDEX_DIR)
+    if state is None or delta is None or not os.path.exists(TENSOR_FILE):
+        return None
+
+    old_users, built_generation = state
+    base_generation, generation, added, removed = delta
+    if built_generation not in (base_generation, generation):
+        return None
+
+    # Read fully: the files are rewritten afterwards, so they must not stay mapped
+    matrix = load_csr(MATRIX_DIR, mmap_mode=None)
+    network = load_csr(NETWORK_DIR, mmap_mode=None)
+    tensor = load_edge_tensor(TENSOR_FILE)
+    if tensor["granularity"] != granularity:
+        print(f"Saved edge tensor is per-{tensor['granularity']}, not per-{granularity}.")
+        return None
+    if built_generation == generation:
+        # The user list may still have changed (extract.py reran)
+        updated = relabel_matrices(matrix, network, tensor, old_users, users)
+        if updated is not None:
+            print("Matrices are already up to date with the index.")
+        return updated
+    return update_email_matrices(matrix, network, tensor, old_users, users, added, removed)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the sparse email matrices.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="apply the latest index delta to the saved matrices")
+    parser.add_argument("--bucket", choices=sorted(BUCKETS), default="month",
+                        help="time bucket of the edge tensor (default: month)")
+    args = parser.parse_args()
+
     print("Loading internal Enron email list...")
     users = load_enron_emails(EMAIL_LIST_FILE)
     print(f"Found {len(users)} internal addresses.")
-    matrix, index = build_email_matrix(users)
-
-    np.save(os.path.join(RESULT_DIR, "email_matrix.npy"), matrix)
-    print("Saved directional email_matrix.npy")
+    generation = read_generation(INDEX_DIR)
 
-    network_matrix = build_symmetric_network_matrix(matrix)
+    updated = None
+    if args.incremental:
+        with stage("incremental_update"):
+            updated = incremental_update(users, args.bucket)
+    if updated is None:
+        if args.incremental:
+            print("Saved matrices do not match the index delta; rebuilding.")
+        with stage("load_index") as counts:
+            index = load_index(INDEX_DIR)
+            counts["messages"] = len(index["path"])
+        # edges: (sender, receiver) message pairs counted into the matrices
+        with stage("matrix") as counts:
+            matrix, rows = build_email_matrix(users, index)
+            network_matrix = build_symmetric_network_matrix(matrix)
+            counts["edges"] = int(matrix.sum())
+        with stage("edge_tensor") as counts:
+            tensor = build_edge_tensor(users, index, args.bucket)
+            counts["edges"] = int(sum(tensor[f].sum() for f in EDGE_FIELDS))
+    else:
+        matrix, network_matrix, tensor = updated
 
-    np.save(os.path.join(RESULT_DIR, "network_email_communication.npy"), network_matrix)
-    print("Saved network_email_communication.npy")
+    with stage("save"):
+        save_matrices(matrix, network_matrix, tensor, users, generation)
+    write_report("email_matrix", users=len(users), incremental=updated is not None,
+                 nnz=int(matrix.nnz), tensor_entries=len(tensor["period"]))
 
     print("Done.")
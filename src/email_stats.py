@@ -1,58 +1,65 @@
 import os
-import re
+import argparse
+import numpy as np
 import matplotlib.pyplot as plt
-from collections import defaultdict
+from maildir_index import INDEX_DIR, default_source, field_entries, load_index, parse_addresses, read_source
+from profiling import stage, write_report
+from sketches import SpaceSaving
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-MAILDIR = os.path.join(BASE_DIR, "maildir")
 FIGDIR = os.path.join(BASE_DIR, "results", "figures")
 
-os.makedirs(FIGDIR, exist_ok=True)
-
-EMAIL_REGEX = re.compile(r'[\w\.-]+@[\w\.-]+')
-
-
-def extract_header(text, key):
-    pattern = rf"{key}:(.*)"
-    matches = re.findall(pattern, text, flags=re.IGNORECASE)
-    emails = set()
-    for m in matches:
-        emails.update(EMAIL_REGEX.findall(m))
-    return {e.lower() for e in emails}
-
-
-send_count = defaultdict(int)
-recv_count = defaultdict(int)
-
-print("Scanning maildir for sender/receiver counts...")
+# Counters per header field in --sketch mode
+CAPACITY = 1000
+TOP = 10
 
-for root, _, files in os.walk(MAILDIR):
-    for file in files:
-        try:
-            with open(os.path.join(root, file), "r", errors="ignore") as f:
-                text = f.read()
-        except:
-            continue
-
-        senders = extract_header(text, "From")
-        receivers = extract_header(text, "To")
-
-        # Only count internal → internal
-        senders = {s for s in senders if s.endswith("@enron.com")}
-        receivers = {r for r in receivers if r.endswith("@enron.com")}
-
-        for s in senders:
-            send_count[s] += 1
-        for r in receivers:
-            recv_count[r] += 1
+os.makedirs(FIGDIR, exist_ok=True)
 
 
-def plot_top(d, title, filename):
-    sorted_items = sorted(d.items(), key=lambda x: x[1], reverse=True)[:10]
+def count_internal(index, field):
+    """Count messages per internal address in a header field."""
+    is_internal = np.array([a.endswith("@enron.com") for a in index["addresses"]], dtype=bool)
+    _, ids = field_entries(index, field)
+    counts = np.bincount(ids[is_internal[ids]], minlength=len(is_internal))
+    return {index["addresses"][i]: int(counts[i]) for i in np.flatnonzero(counts)}
+
+
+def sketch_internal(messages, capacity=CAPACITY, counts=None):
+    """
+    Stream (path, size, mtime_ns, headers) tuples into one SpaceSaving
+    summary per field ("from", "to") over internal addresses. Memory is
+    bounded by capacity however large the corpus.
+    """
+    sketches = {field: SpaceSaving(capacity) for field in ("from", "to")}
+    for _, _, _, headers in messages:
+        for field, sketch in sketches.items():
+            sketch.update(a for a in parse_addresses(headers.get(field, ""))
+                          if a.endswith("@enron.com"))
+        if counts is not None:
+            counts["files"] = counts.get("files", 0) + 1
+    return sketches
+
+
+def validate(sketch, exact, k=TOP):
+    """Compare a sketch's top k with exact counts; returns recall and the largest overestimate."""
+    true_top = {a for a, _ in sorted(exact.items(), key=lambda x: x[1], reverse=True)[:k]}
+    top = sketch.top(k)
+    recall = len(true_top & {a for a, _, _ in top}) / max(len(true_top), 1)
+    max_error = max((count - exact.get(a, 0) for a, count, _ in top), default=0)
+    bounds_hold = all(count - error <= exact.get(a, 0) <= count for a, count, error in top)
+    return {"recall": recall, "max_error": int(max_error), "bounds_hold": bounds_hold}
+
+
+def plot_top(d, title, filename, errors=None):
+    sorted_items = sorted(d.items(), key=lambda x: x[1], reverse=True)[:TOP]
     labels, values = zip(*sorted_items)
 
     plt.figure(figsize=(12, 7))
-    plt.barh(labels, values)
+    if errors:
+        # Space-Saving estimates are upper bounds; the bar spans [estimate - error, estimate]
+        plt.barh(labels, values, xerr=[[errors[a] for a in labels], [0] * len(labels)])
+    else:
+        plt.barh(labels, values)
     plt.title(title)
     plt.xlabel("Number of emails")
     plt.gca().invert_yaxis()
@@ -62,7 +69,59 @@ def plot_top(d, title, filename):
     print(f"Saved figure: {filename}")
 
 
-plot_top(send_count, "Top 10 Internal Email Senders", "top_senders.png")
-plot_top(recv_count, "Top 10 Internal Email Receivers", "top_receivers.png")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the top internal senders and receivers.")
+    parser.add_argument("--sketch", action="store_true",
+                        help="count with bounded-memory Space-Saving sketches while streaming "
+                             "message headers, instead of exact counts from the index")
+    parser.add_argument("--source", default=None,
+                        help="maildir directory or tarball for --sketch (default: maildir/, "
+                             "or the CMU tarball if maildir/ is missing)")
+    parser.add_argument("--capacity", type=int, default=CAPACITY,
+                        help=f"counters per sketch (default: {CAPACITY})")
+    parser.add_argument("--validate", action="store_true",
+                        help="with --sketch, compare the top 10 with exact counts from the index")
+    args = parser.parse_args()
+
+    send_errors = recv_errors = None
+    checks = {}
+    if args.sketch:
+        source = args.source or default_source()
+        print(f"Streaming message headers from {source} into sketches...")
+        # Only count internal → internal
+        with stage("sketch") as counts:
+            sketches = sketch_internal(read_source(source), args.capacity, counts)
+        send_count, send_errors = {}, {}
+        recv_count, recv_errors = {}, {}
+        for field, count, errors in (("from", send_count, send_errors), ("to", recv_count, recv_errors)):
+            for address, estimate, error in sketches[field].top(TOP):
+                count[address], errors[address] = estimate, error
+
+        if args.validate:
+            with stage("validate"):
+                index = load_index(INDEX_DIR)
+                for field in ("from", "to"):
+                    checks[field] = validate(sketches[field], count_internal(index, field))
+                    print(f"{field}: top-{TOP} recall {checks[field]['recall']:.2f}, "
+                          f"max overestimate {checks[field]['max_error']}, "
+                          f"bounds hold: {checks[field]['bounds_hold']}")
+    else:
+        print("Loading maildir index for sender/receiver counts...")
+
+        with stage("load_index") as counts:
+            index = load_index(INDEX_DIR)
+            counts["messages"] = len(index["path"])
 
-print("Done.")
+        # Only count internal → internal
+        with stage("count") as counts:
+            send_count = count_internal(index, "from")
+            recv_count = count_internal(index, "to")
+            counts["messages"] = len(index["path"])
+
+    with stage("plot"):
+        plot_top(send_count, "Top 10 Internal Email Senders", "top_senders.png", send_errors)
+        plot_top(recv_count, "Top 10 Internal Email Receivers", "top_receivers.png", recv_errors)
+
+    write_report("email_stats", sketch=args.sketch, capacity=args.capacity if args.sketch else None,
+                 validation=checks or None)
+    print("Done.")
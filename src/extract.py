@@ -1,43 +1,107 @@
 import os
-import re
+import heapq
+import argparse
+import tempfile
+from maildir_index import FIELDS, INDEX_DIR, default_source, load_index, parse_addresses, read_source
+from profiling import stage, write_report
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-MAILDIR = os.path.join(BASE_DIR, "maildir")
 OUTPUT = os.path.join(BASE_DIR, "data", "email_address")
 
+# Distinct addresses held in memory before a sorted run is spilled (--stream)
+RUN_SIZE = 1_000_000
+
 os.makedirs(OUTPUT, exist_ok=True)
 
-EMAIL_REGEX = re.compile(r'[\w\.-]+@[\w\.-]+')
+
+def _spill(addresses, tmp_dir):
+    """Write a sorted run of addresses to a temporary file; returns its path."""
+    with tempfile.NamedTemporaryFile("w", dir=tmp_dir, suffix=".run", delete=False) as f:
+        for address in sorted(addresses):
+            f.write(address + "\n")
+    return f.name
 
 
-def extract_emails_from_file(fp):
-    emails = set()
-    try:
-        with open(fp, "r", errors="ignore") as f:
-            emails.update(EMAIL_REGEX.findall(f.read()))
-    except:
-        pass
-    return emails
+def stream_addresses(messages, run_size=RUN_SIZE, tmp_dir=None):
+    """
+    Yield the distinct header addresses of a message stream (see
+    maildir_index.read_source()) in sorted order. At most run_size of them
+    are held in memory: full runs are spilled to sorted temporary files,
+    which are merged at the end.
+    """
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        runs, current = [], set()
+        for _, _, _, headers in messages:
+            for field in FIELDS:
+                current.update(parse_addresses(headers.get(field, "")))
+            if len(current) >= run_size:
+                runs.append(_spill(current, tmp))
+                current = set()
+        if not runs:
+            yield from sorted(current)
+            return
+        if current:
+            runs.append(_spill(current, tmp))
 
+        files = [open(path, "r") for path in runs]
+        try:
+            last = None
+            for line in heapq.merge(*files):
+                if line != last:
+                    yield line.rstrip("\n")
+                    last = line
+        finally:
+            for f in files:
+                f.close()
 
-print("Extracting all emails...")
 
-all_emails = set()
+def write_addresses(addresses):
+    """Write all_emails.txt and enron_emails.txt from sorted addresses; returns both counts."""
+    n_all = n_enron = 0
+    with open(os.path.join(OUTPUT, "all_emails.txt"), "w") as all_file, \
+            open(os.path.join(OUTPUT, "enron_emails.txt"), "w") as enron_file:
+        for e in addresses:
+            all_file.write(e + "\n")
+            n_all += 1
+            if e.endswith("@enron.com"):
+                enron_file.write(e + "\n")
+                n_enron += 1
+    return n_all, n_enron
 
-for root, _, files in os.walk(MAILDIR):
-    for f in files:
-        all_emails.update(extract_emails_from_file(os.path.join(root, f)))
 
-enron_emails = {e.lower() for e in all_emails if e.lower().endswith("@enron.com")}
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the all/internal email address lists.")
+    parser.add_argument("--stream", action="store_true",
+                        help="discover addresses by streaming message headers with bounded memory "
+                             "instead of reading the index")
+    parser.add_argument("--source", default=None,
+                        help="maildir directory or tarball for --stream (default: maildir/, "
+                             "or the CMU tarball if maildir/ is missing)")
+    parser.add_argument("--run-size", type=int, default=RUN_SIZE,
+                        help=f"addresses kept in memory per sorted run with --stream (default: {RUN_SIZE})")
+    args = parser.parse_args()
 
-with open(os.path.join(OUTPUT, "all_emails.txt"), "w") as f:
-    for e in sorted(all_emails):
-        f.write(e + "\n")
+    if args.stream:
+        source = args.source or default_source()
+        print(f"Streaming message headers from {source}...")
+        with stage("stream") as counts:
+            def counted(messages):
+                for message in messages:
+                    counts["files"] = counts.get("files", 0) + 1
+                    yield message
+            n_all, n_enron = write_addresses(stream_addresses(counted(read_source(source)),
+                                                              args.run_size))
+    else:
+        print("Loading maildir index...")
+        # Every address seen while indexing (see maildir_index.py)
+        with stage("load_index") as counts:
+            all_emails = load_index(INDEX_DIR)["addresses"]
+            counts["addresses"] = len(all_emails)
 
-with open(os.path.join(OUTPUT, "enron_emails.txt"), "w") as f:
-    for e in sorted(enron_emails):
-        f.write(e + "\n")
+        with stage("write"):
+            n_all, n_enron = write_addresses(all_emails)
 
-print(f"Total emails found: {len(all_emails)}")
-print(f"Internal Enron emails: {len(enron_emails)}")
-print("Saved results in data/email_address/")
+    print(f"Total emails found: {n_all}")
+    print(f"Internal Enron emails: {n_enron}")
+    print("Saved results in data/email_address/")
+    write_report("extract", stream=args.stream)
@@ -0,0 +1,586 @@
+import io
+import os
+import re
+import tarfile
+import argparse
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from email.utils import parsedate_to_datetime
+from profiling import stage, write_report
+
+# --------------------------------
+# Paths
+# --------------------------------
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAILDIR = os.path.join(BASE_DIR, "maildir")
+# The CMU download; indexed directly when maildir/ was not extracted
+TARBALL = os.path.join(BASE_DIR, "enron_mail_20150507.tar.gz")
+INDEX_DIR = os.path.join(BASE_DIR, "data", "index")
+
+ADDRESS_FILE = "addresses.txt"
+MESSAGE_FILE = "messages.npz"
+DELTA_FILE = "delta.npz"
+
+EMAIL_REGEX = re.compile(r'[\w\.-]+@[\w\.-]+')
+
+# Address fields stored per message, as CSR-style (ptr, ids) column pairs
+FIELDS = ("from", "to", "cc", "bcc")
+# Plain per-message columns; path/size/mtime double as the file manifest
+COLUMNS = ("path", "size", "mtime", "message_id", "date")
+HEADERS = ("message-id", "date") + FIELDS
+# Messages per parse task when indexing a tarball with workers
+TAR_BATCH = 4096
+
+
+# --------------------------------
+# Parsing
+# --------------------------------
+def read_headers(f, wanted=HEADERS):
+    """
+    Read the RFC 822 header block of an open message, stopping at the first
+    blank line so the body is never read. Folded continuation lines are
+    joined onto their header. Returns {lowercased name: value} for the
+    wanted headers (first occurrence wins).
+    """
+    headers = {}
+    name = None
+    for line in f:
+        if not line.strip():
+            break
+        if line[0] in " \t":
+            if name is not None:
+                headers[name] += " " + line.strip()
+            continue
+        key, sep, value = line.partition(":")
+        name = key.strip().lower()
+        if not sep or name not in wanted or name in headers:
+            name = None
+            continue
+        headers[name] = value.strip()
+    return headers
+
+
+def parse_addresses(value):
+    """Return the set of lowercased addresses in a header value."""
+    return {e.lower() for e in EMAIL_REGEX.findall(value)}
+
+
+def parse_date(value):
+    """Parse an RFC 822 date into unix seconds, or -1 if it cannot be read."""
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return -1
+
+
+def parse_message(headers):
+    """
+    Turn the headers from read_headers() into an index record
+    (message_id, date and one address set per field).
+    """
+    record = {
+        "message_id": headers.get("message-id", ""),
+        "date": parse_date(headers["date"]) if "date" in headers else -1,
+    }
+    for field in FIELDS:
+        record[field] = parse_addresses(headers.get(field, ""))
+    return record
+
+
+def iter_maildir(maildir):
+    """Yield every message path under maildir, in a stable order."""
+    if os.path.isfile(maildir):
+        yield maildir
+        return
+    for root, dirs, files in os.walk(maildir):
+        dirs.sort()
+        for file in sorted(files):
+            yield os.path.join(root, file)
+
+
+# --------------------------------
+# Index building
+# --------------------------------
+def read_files(paths, maildir):
+    """Yield (relative path, size, mtime_ns, headers) for every readable file."""
+    for fp in paths:
+        try:
+            with open(fp, "r", errors="ignore") as f:
+                stat = os.fstat(f.fileno())
+                headers = read_headers(f)
+        except OSError:
+            continue
+        yield os.path.relpath(fp, maildir), stat.st_size, stat.st_mtime_ns, headers
+
+
+def read_tarball(tar_path):
+    """
+    Yield (relative path, size, mtime_ns, headers) for every message in a
+    maildir tarball, decompressing it as one sequential stream. Paths are
+    relative to the archive's top-level maildir/ directory, and mtimes are
+    the member mtimes (which tar restores on extraction), so the manifest
+    matches that of the extracted tree.
+    """
+    with tarfile.open(tar_path, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            parts = member.name.split("/")
+            rel_path = os.path.join(*parts[1:]) if parts[0] == "maildir" and len(parts) > 1 else member.name
+            # Stream members are not seekable; decode only up to the blank line
+            head = tar.extractfile(member).read().partition(b"\n\n")[0]
+            headers = read_headers(io.TextIOWrapper(io.BytesIO(head), errors="ignore"))
+            yield rel_path, member.size, member.mtime * 10**9, headers
+
+
+def default_source():
+    """maildir/, or the CMU tarball when maildir/ was not extracted."""
+    if not os.path.isdir(MAILDIR) and os.path.exists(TARBALL):
+        return TARBALL
+    return MAILDIR
+
+
+def read_source(source):
+    """read_tarball() for an archive, read_files() over the tree for a directory."""
+    if os.path.isfile(source) and tarfile.is_tarfile(source):
+        return read_tarball(source)
+    return read_files(iter_maildir(source), source)
+
+
+def index_messages(messages):
+    """
+    Parse (relative path, size, mtime_ns, headers) tuples into a partial index.
+    Address ids are local to the partial index; see merge_indexes().
+    """
+    address_ids = {}
+    rel_paths, sizes, mtimes, message_ids, dates = [], [], [], [], []
+    columns = {field: ([0], []) for field in FIELDS}
+
+    def intern(address):
+        if address not in address_ids:
+            address_ids[address] = len(address_ids)
+        return address_ids[address]
+
+    for rel_path, size, mtime, headers in messages:
+        record = parse_message(headers)
+
+        rel_paths.append(rel_path)
+        sizes.append(size)
+        mtimes.append(mtime)
+        message_ids.append(record["message_id"])
+        dates.append(record["date"])
+        for field in FIELDS:
+            ptr, ids = columns[field]
+            ids.extend(intern(a) for a in sorted(record[field]))
+            ptr.append(len(ids))
+
+    # Re-number addresses so the table is sorted
+    addresses = sorted(address_ids)
+    remap = np.empty(len(addresses), dtype=np.int32)
+    for new_id, address in enumerate(addresses):
+        remap[address_ids[address]] = new_id
+
+    index = {
+        "addresses": addresses,
+        "path": np.array(rel_paths, dtype=str),
+        "size": np.array(sizes, dtype=np.int64),
+        "mtime": np.array(mtimes, dtype=np.int64),
+        "message_id": np.array(message_ids, dtype=str),
+        "date": np.array(dates, dtype=np.int64),
+    }
+    for field in FIELDS:
+        ptr, ids = columns[field]
+        index[f"{field}_ptr"] = np.array(ptr, dtype=np.int64)
+        index[f"{field}_ids"] = remap[np.array(ids, dtype=np.int64)]
+    return index
+
+
+def index_files(paths, maildir):
+    """Parse the given message files into a partial index."""
+    return index_messages(read_files(paths, maildir))
+
+
+def index_mailbox(maildir, mailbox):
+    """Worker task: index one top-level mailbox directory."""
+    return index_files(iter_maildir(os.path.join(maildir, mailbox)), maildir)
+
+
+def index_paths(maildir, rel_paths):
+    """Worker task: index an explicit list of maildir-relative paths."""
+    return index_files([os.path.join(maildir, p) for p in rel_paths], maildir)
+
+
+def merge_indexes(parts):
+    """
+    Reduce partial indexes into one, re-numbering every part's local address
+    ids against the merged (sorted) address table.
+    """
+    if not parts:
+        return index_messages([])
+    addresses = sorted(set().union(*(part["addresses"] for part in parts)))
+    global_ids = {address: i for i, address in enumerate(addresses)}
+
+    index = {"addresses": addresses}
+    for column in COLUMNS:
+        index[column] = np.concatenate([part[column] for part in parts])
+
+    for field in FIELDS:
+        ptrs, ids = [np.zeros(1, dtype=np.int64)], []
+        offset = 0
+        for part in parts:
+            remap = np.array([global_ids[a] for a in part["addresses"]], dtype=np.int32)
+            ptrs.append(part[f"{field}_ptr"][1:] + offset)
+            ids.append(remap[part[f"{field}_ids"]])
+            offset += len(part[f"{field}_ids"])
+        index[f"{field}_ptr"] = np.concatenate(ptrs)
+        index[f"{field}_ids"] = np.concatenate(ids).astype(np.int32)
+    return index
+
+
+def build_index(maildir=MAILDIR, workers=1):
+    """
+    Read every message once and build the columnar header index.
+    With workers > 1, top-level mailboxes are parsed across a process pool
+    and the partial indexes are merged in the parent.
+    Returns a dict of numpy columns plus the "addresses" table; address ids
+    in the <field>_ids columns index into that table.
+    """
+    mailboxes = sorted(os.listdir(maildir))
+    print(f"Indexing {len(mailboxes)} mailboxes under {maildir} ({workers} worker(s))...")
+
+    with stage("parse") as counts:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(index_mailbox, repeat(maildir), mailboxes))
+        else:
+            parts = [index_mailbox(maildir, mailbox) for mailbox in mailboxes]
+        counts["files"] = sum(len(part["path"]) for part in parts)
+        counts["bytes"] = sum(int(part["size"].sum()) for part in parts)
+
+    with stage("merge"):
+        index = merge_indexes(parts)
+    print(f"Indexed {len(index['path'])} messages, {len(index['addresses'])} distinct addresses.")
+    return index
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def index_stream(messages, workers=1):
+    """
+    Parse a stream of messages (see read_tarball()) into partial indexes.
+    With workers > 1, batches are parsed across a process pool while the
+    stream is read, with at most two batches per worker in flight.
+    """
+    if workers <= 1:
+        return [index_messages(messages)]
+    parts, pending = [], deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in _batches(messages, TAR_BATCH):
+            pending.append(pool.submit(index_messages, batch))
+            if len(pending) >= 2 * workers:
+                parts.append(pending.popleft().result())
+        parts.extend(future.result() for future in pending)
+    return parts or [index_messages([])]
+
+
+def build_index_from_tarball(tar_path=TARBALL, workers=1):
+    """
+    Build the index straight from a maildir tarball, without extracting it.
+    The archive is decompressed sequentially in this process; header
+    parsing is spread over `workers` processes (see index_stream()).
+    """
+    print(f"Indexing {tar_path} ({workers} worker(s))...")
+    with stage("parse") as counts:
+        parts = index_stream(read_tarball(tar_path), workers)
+        counts["files"] = sum(len(part["path"]) for part in parts)
+        counts["bytes"] = sum(int(part["size"].sum()) for part in parts)
+        counts["compressed_bytes"] = os.path.getsize(tar_path)
+
+    with stage("merge"):
+        index = merge_indexes(parts)
+    print(f"Indexed {len(index['path'])} messages, {len(index['addresses'])} distinct addresses.")
+    return index
+
+
+def take_rows(index, mask):
+    """Return the messages selected by a boolean mask (same address table)."""
+    part = {"addresses": index["addresses"]}
+    for column in COLUMNS:
+        part[column] = index[column][mask]
+    for field in FIELDS:
+        messages, ids = field_entries(index, field)
+        part[f"{field}_ptr"] = np.concatenate(([0], np.cumsum(np.diff(index[f"{field}_ptr"])[mask])))
+        part[f"{field}_ids"] = ids[mask[messages]]
+    return part
+
+
+def prune_addresses(index):
+    """Drop addresses no message references, re-numbering the address ids."""
+    used = np.unique(np.concatenate([index[f"{field}_ids"] for field in FIELDS]))
+    remap = np.full(len(index["addresses"]), -1, dtype=np.int32)
+    remap[used] = np.arange(len(used), dtype=np.int32)
+    part = dict(index, addresses=[index["addresses"][i] for i in used])
+    for field in FIELDS:
+        part[f"{field}_ids"] = remap[index[f"{field}_ids"]]
+    return part
+
+
+def scan_maildir(maildir):
+    """Return {relative path: (size, mtime_ns)} for every file in maildir."""
+    manifest = {}
+    for fp in iter_maildir(maildir):
+        try:
+            stat = os.stat(fp)
+        except OSError:
+            continue
+        manifest[os.path.relpath(fp, maildir)] = (stat.st_size, stat.st_mtime_ns)
+    return manifest
+
+
+def update_index(old, maildir=MAILDIR, workers=1):
+    """
+    Bring an existing index up to date by parsing only files that are new or
+    whose size/mtime changed; rows for deleted or changed files are dropped.
+    Returns:
+        index (new full index),
+        added (rows parsed in this run, on the new index's address table),
+        removed (old rows that were dropped, with a table of the addresses
+                 they reference)
+    Addresses only dropped rows referenced leave the new index, as in a
+    full rebuild.
+    """
+    with stage("scan") as counts:
+        current = scan_maildir(maildir)
+        counts["files"] = len(current)
+    old_stats = zip(old["path"], old["size"].tolist(), old["mtime"].tolist())
+    unchanged = {p for p, size, mtime in old_stats if current.get(p) == (size, mtime)}
+
+    keep = np.array([p in unchanged for p in old["path"]], dtype=bool)
+    changed = sorted(p for p in current if p not in unchanged)
+    print(f"Incremental index: {len(changed)} new/changed files, "
+          f"{int((~keep).sum())} stale rows, {len(unchanged)} unchanged.")
+
+    # Group changed files by mailbox so workers get whole mailboxes
+    groups = {}
+    for p in changed:
+        groups.setdefault(p.split(os.sep)[0], []).append(p)
+    batches = [groups[m] for m in sorted(groups)]
+
+    with stage("parse") as counts:
+        if workers > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(index_paths, repeat(maildir), batches))
+        else:
+            parts = [index_paths(maildir, batch) for batch in batches]
+        counts["files"] = sum(len(part["path"]) for part in parts)
+        counts["bytes"] = sum(int(part["size"].sum()) for part in parts)
+
+    return apply_changes(old, keep, parts)
+
+
+def update_index_from_tarball(old, tar_path=TARBALL, workers=1):
+    """
+    update_index() for a tarball source. The whole archive is still
+    decompressed, but only members that are new or whose size/mtime
+    changed are parsed.
+    """
+    old_stats = dict(zip(old["path"], zip(old["size"].tolist(), old["mtime"].tolist())))
+    current = {}
+
+    def changed(messages):
+        for message in messages:
+            rel_path, size, mtime, _ = message
+            current[rel_path] = (size, mtime)
+            if old_stats.get(rel_path) != (size, mtime):
+                yield message
+
+    with stage("parse") as counts:
+        parts = index_stream(changed(read_tarball(tar_path)), workers)
+        counts["files"] = len(current)
+        counts["bytes"] = sum(size for size, _ in current.values())
+        counts["compressed_bytes"] = os.path.getsize(tar_path)
+
+    keep = np.array([current.get(p) == stat for p, stat in old_stats.items()], dtype=bool)
+    print(f"Incremental index: {sum(len(part['path']) for part in parts)} new/changed members, "
+          f"{int((~keep).sum())} stale rows, {int(keep.sum())} unchanged.")
+    return apply_changes(old, keep, parts)
+
+
+def apply_changes(old, keep, parts):
+    """
+    Combine the kept rows of old with newly parsed partial indexes. Returns
+    (index, added, removed) as described in update_index().
+    """
+    # The new address table holds only addresses that kept or added rows
+    # reference, as after a full rebuild; removed rows keep their own table
+    with stage("merge"):
+        kept = prune_addresses(take_rows(old, keep))
+        removed = prune_addresses(take_rows(old, ~keep))
+        index = merge_indexes([kept] + parts)
+
+    added = take_rows(index, np.arange(len(index["path"])) >= len(kept["path"]))
+    return index, added, removed
+
+
+def save_index(index, index_dir=INDEX_DIR, delta=None):
+    """
+    Write the index. Every save bumps the index generation; delta, an
+    (added, removed) pair from update_index(), is stored so downstream stages
+    can move from the previous generation to this one without a rebuild.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    previous = read_generation(index_dir)
+    generation = 0 if previous is None else previous + 1
+
+    with open(os.path.join(index_dir, ADDRESS_FILE), "w") as f:
+        for address in index["addresses"]:
+            f.write(address + "\n")
+    columns = {k: v for k, v in index.items() if k not in ("addresses", "generation")}
+    np.savez(os.path.join(index_dir, MESSAGE_FILE), generation=generation, **columns)
+
+    delta_path = os.path.join(index_dir, DELTA_FILE)
+    if delta is None or previous is None:
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+    else:
+        added, removed = delta
+        arrays = {f"added_{k}": v for k, v in added.items() if k != "addresses"}
+        arrays.update({f"removed_{k}": v for k, v in removed.items()})
+        np.savez(delta_path, base_generation=previous, generation=generation, **arrays)
+    return generation
+
+
+def read_generation(index_dir=INDEX_DIR):
+    """Return the generation of the saved index, or None if there is none."""
+    path = os.path.join(index_dir, MESSAGE_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return int(data["generation"]) if "generation" in data.files else None
+
+
+def load_index(index_dir=INDEX_DIR):
+    """Load the index written by save_index()."""
+    with open(os.path.join(index_dir, ADDRESS_FILE), "r") as f:
+        addresses = [line.rstrip("\n") for line in f]
+    with np.load(os.path.join(index_dir, MESSAGE_FILE)) as data:
+        index = {k: data[k] for k in data.files}
+    index["addresses"] = addresses
+    return index
+
+
+def load_delta(index_dir=INDEX_DIR):
+    """
+    Load the delta written with the current index generation.
+    Returns (base_generation, generation, added, removed), or None if the
+    last save was a full rebuild. added uses the index address table and
+    removed its own (older deltas: the index table).
+    """
+    path = os.path.join(index_dir, DELTA_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(os.path.join(index_dir, ADDRESS_FILE), "r") as f:
+        addresses = [line.rstrip("\n") for line in f]
+    added, removed = {"addresses": addresses}, {"addresses": addresses}
+    with np.load(path) as data:
+        for key in data.files:
+            if key.startswith("added_"):
+                added[key[len("added_"):]] = data[key]
+            elif key.startswith("removed_"):
+                removed[key[len("removed_"):]] = data[key]
+        if "removed_addresses" in data.files:
+            removed["addresses"] = data["removed_addresses"].tolist()
+        return int(data["base_generation"]), int(data["generation"]), added, removed
+
+
+# --------------------------------
+# Queries
+# --------------------------------
+def field_entries(index, field):
+    """Return (message row, address id) arrays for every entry of a field."""
+    ptr = index[f"{field}_ptr"]
+    messages = np.repeat(np.arange(len(ptr) - 1), np.diff(ptr))
+    return messages, index[f"{field}_ids"]
+
+
+def message_pairs(index, src_field, dst_field, id_map, with_messages=False):
+    """
+    Expand every message into its (sender, receiver) pairs.
+    id_map maps address ids to output ids (-1 drops the address).
+    Returns (src, dst) arrays of mapped ids, one entry per message and pair,
+    with self-pairs removed; with_messages=True prepends the message row of
+    each pair.
+    """
+    n = len(index["path"])
+    smsg, sids = field_entries(index, src_field)
+    dmsg, dids = field_entries(index, dst_field)
+    sids, dids = id_map[sids], id_map[dids]
+    smsg, sids = smsg[sids >= 0], sids[sids >= 0]
+    dmsg, dids = dmsg[dids >= 0], dids[dids >= 0]
+
+    # Receivers are grouped by message; dptr[m] is where message m starts
+    dcount = np.bincount(dmsg, minlength=n)
+    dptr = np.concatenate(([0], np.cumsum(dcount)))
+
+    reps = dcount[smsg]
+    src = np.repeat(sids, reps)
+    starts = np.repeat(dptr[smsg] - (np.cumsum(reps) - reps), reps)
+    dst = dids[starts + np.arange(len(src))]
+
+    keep = src != dst
+    if with_messages:
+        return np.repeat(smsg, reps)[keep], src[keep], dst[keep]
+    return src[keep], dst[keep]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index maildir headers into data/index/.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parse mailboxes across this many processes")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only parse files that are new or changed since the last run")
+    parser.add_argument("--tarball", nargs="?", const=TARBALL, metavar="PATH",
+                        help="read messages from a maildir .tar.gz instead of maildir/ "
+                             "(default when maildir/ is missing and the CMU tarball is present)")
+    args = parser.parse_args()
+
+    tarball = args.tarball
+    if tarball is None and default_source() == TARBALL:
+        tarball = TARBALL
+
+    old = None
+    if args.incremental and read_generation(INDEX_DIR) is not None:
+        old = load_index(INDEX_DIR)
+        if "mtime" not in old:
+            print("Existing index has no file manifest; rebuilding from scratch.")
+            old = None
+
+    if old is None:
+        if tarball:
+            index = build_index_from_tarball(tarball, workers=args.workers)
+        else:
+            index = build_index(MAILDIR, workers=args.workers)
+        with stage("save"):
+            generation = save_index(index, INDEX_DIR)
+    else:
+        if tarball:
+            index, added, removed = update_index_from_tarball(old, tarball, workers=args.workers)
+        else:
+            index, added, removed = update_index(old, MAILDIR, workers=args.workers)
+        with stage("save"):
+            generation = save_index(index, INDEX_DIR, delta=(added, removed))
+    print(f"Saved header index (generation {generation}) in {INDEX_DIR}")
+    write_report("maildir_index", source=tarball or MAILDIR, workers=args.workers,
+                 incremental=old is not None,
+                 messages=len(index["path"]), addresses=len(index["addresses"]))
@@ -0,0 +1,77 @@
+import time
+import asyncio
+import hashlib
+import argparse
+from aiohttp import web
+
+# ------------------------------------------------------
+# Minimal OpenAI-compatible server for testing the openai backend
+# ------------------------------------------------------
+# Answers /v1/chat/completions deterministically from a hash of the user
+# message, honouring the vLLM extensions the client uses (guided_choice,
+# continue_final_message). GET /stats reports request counts and the peak
+# number of requests in flight.
+ROLES = ("Executive/Leader", "Coordinator", "Bridge/Broker", "Community Hub", "Peripheral Node")
+# Mutable counters (requests, in_flight, max_in_flight); a running app's
+# own keys must not change, so they live in one dict set by make_app()
+STATS = web.AppKey("stats", dict)
+DELAY = web.AppKey("delay", float)
+
+
+async def chat_completions(request):
+    stats = request.app[STATS]
+    body = await request.json()
+    stats["requests"] += 1
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    try:
+        await asyncio.sleep(request.app[DELAY])
+    finally:
+        stats["in_flight"] -= 1
+
+    user = next(m["content"] for m in body["messages"] if m["role"] == "user")
+    pick = int(hashlib.sha256(user.encode("utf-8")).hexdigest(), 16)
+    if body.get("guided_choice"):
+        content = body["guided_choice"][pick % len(body["guided_choice"])]
+    elif body.get("continue_final_message"):
+        content = " Mock explanation."
+    else:
+        content = f"{ROLES[pick % len(ROLES)]}: Mock explanation."
+
+    choice = {"index": 0, "finish_reason": "stop",
+              "message": {"role": "assistant", "content": content}}
+    if body.get("logprobs"):
+        choice["logprobs"] = {"content": [{"token": content, "logprob": -0.1}]}
+    return web.json_response({
+        "id": f"chatcmpl-{stats['requests']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [choice],
+        # Whitespace-separated words stand in for tokens
+        "usage": {"prompt_tokens": sum(len(m["content"].split()) for m in body["messages"]),
+                  "completion_tokens": len(content.split())},
+    })
+
+
+async def get_stats(request):
+    stats = request.app[STATS]
+    return web.json_response({"requests": stats["requests"], "max_in_flight": stats["max_in_flight"]})
+
+
+def make_app(delay=0.0):
+    app = web.Application()
+    app[DELAY] = delay
+    app[STATS] = {"requests": 0, "in_flight": 0, "max_in_flight": 0}
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.05,
+                        help="seconds each request takes (default: 0.05)")
+    args = parser.parse_args()
+    web.run_app(make_app(args.delay), port=args.port)
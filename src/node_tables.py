@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import pandas as pd
+
+# ------------------------------------------------------
+# Node-level Parquet tables
+# ------------------------------------------------------
+# analyze_matrix.py writes one Parquet table per result, keyed by the
+# integer node_id (the user's row in the matrices). Email strings are
+# stored once, in nodes.parquet; the other tables only carry node_id.
+NODES = "nodes"
+TABLES = ("basic_stats", "centrality", "communities")
+
+
+def table_path(out_dir, name):
+    return os.path.join(out_dir, f"{name}.parquet")
+
+
+def save_nodes(emails, out_dir):
+    """Write the node_id → email dictionary."""
+    save_table(pd.DataFrame({"email": pd.Series(emails, dtype="string")}), NODES, out_dir)
+
+
+def save_table(df, name, out_dir):
+    """Write a table holding one row per node, in node_id order."""
+    df = df.reset_index(drop=True)
+    df.insert(0, "node_id", np.arange(len(df), dtype=np.int32))
+    df.to_parquet(table_path(out_dir, name), index=False)
+
+
+def load_nodes(analysis_dir, tables=TABLES, with_email=True):
+    """
+    Join node tables on node_id, rows following the first table; missing
+    tables are skipped with a warning. with_email adds the email column from
+    the node dictionary.
+    """
+    parts = []
+    for name in ((NODES,) if with_email else ()) + tuple(tables):
+        path = table_path(analysis_dir, name)
+        if not os.path.exists(path):
+            print(f"[Warning] Missing file: {path}")
+            continue
+        print(f"Loading {name}: {path}")
+        parts.append(pd.read_parquet(path).set_index("node_id"))
+
+    df = parts[0].join(parts[1:], how="left") if len(parts) > 1 else parts[0]
+    df.index = df.index.astype(np.int32)
+    return df.reset_index()
@@ -0,0 +1,272 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from profiling import record, run_id, write_report
+
+# ------------------------------------------------------
+# Paths
+# ------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(BASE_DIR, "src")
+STATE_FILE = os.path.join(BASE_DIR, "data", "pipeline_state.json")
+LOG_DIR = os.path.join(BASE_DIR, "results", "logs")
+
+# Inputs too large to read on every run: hashed by (path, size, mtime)
+TARBALL = "enron_mail_20150507.tar.gz"
+STAT_INPUTS = ("maildir", TARBALL)
+
+# ------------------------------------------------------
+# Stages
+# ------------------------------------------------------
+# Paths are relative to the project root. A stage depends on every stage
+# that writes one of its inputs; its code (the script and the local modules
+# it imports) is part of its input hash. "workers" stages get --workers.
+FIGURES = "results/figures"
+ANALYSIS = "results/matrix_analysis"
+NODE_TABLES = [f"{ANALYSIS}/{name}.parquet" for name in
+               ("nodes", "basic_stats", "centrality", "communities")]
+
+STAGES = [
+    {"name": "index", "script": "maildir_index.py", "args": ["--incremental"], "workers": True,
+     "inputs": ["maildir", TARBALL], "outputs": ["data/index"]},
+    {"name": "extract", "script": "extract.py",
+     "inputs": ["data/index"],
+     "outputs": ["data/email_address/all_emails.txt", "data/email_address/enron_emails.txt"]},
+    {"name": "email_stats", "script": "email_stats.py",
+     "inputs": ["data/index"],
+     "outputs": [f"{FIGURES}/top_senders.png", f"{FIGURES}/top_receivers.png"]},
+    {"name": "email_matrix", "script": "email_matrix.py", "args": ["--incremental"],
+     "inputs": ["data/index", "data/email_address/enron_emails.txt"],
+     "outputs": ["data/matrix"]},
+    {"name": "analyze_matrix", "script": "analyze_matrix.py", "workers": True,
+     "inputs": ["data/matrix", "data/email_address/enron_emails.txt"],
+     "outputs": NODE_TABLES + [f"{ANALYSIS}/community_modularity.csv"]},
+    {"name": "analyze_results", "script": "analyze_results.py", "workers": True,
+     "inputs": NODE_TABLES,
+     "outputs": [f"{FIGURES}/{m}_distribution.png" for m in
+                 ("sent", "received", "balance", "degree", "betweenness", "closeness",
+                  "pagerank", "eigenvector")]
+                + [f"{FIGURES}/community_sizes.png", f"{FIGURES}/degree_vs_pagerank.png",
+                   f"{FIGURES}/betweenness_vs_closeness.png", f"{FIGURES}/degree_vs_closeness.png"]},
+    {"name": "build_dataset", "script": "build_dataset.py",
+     "inputs": NODE_TABLES,
+     "outputs": ["results/final_dataset/enron_node_dataset.parquet"]},
+    {"name": "classify_roles", "script": "classify_roles_qwen.py", "args": ["--resume"], "llm": True,
+     "inputs": ["results/final_dataset/enron_node_dataset.parquet"],
+     "outputs": ["results/LLM/enron_roles_qwen.csv"]},
+    {"name": "plot_roles", "script": "plot_role_distribution.py", "llm": True,
+     "inputs": ["results/LLM/enron_roles_qwen.csv"],
+     "outputs": [f"{FIGURES}/role_distribution.png"]},
+]
+
+
+# ------------------------------------------------------
+# Hashing
+# ------------------------------------------------------
+def _hash_file(h, path):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+
+def hash_path(rel_path):
+    """Content hash of a file or directory tree (stat manifest for STAT_INPUTS)."""
+    path = os.path.join(BASE_DIR, rel_path)
+    h = hashlib.sha256()
+    by_stat = rel_path in STAT_INPUTS
+    if os.path.isfile(path):
+        if by_stat:
+            st = os.stat(path)
+            h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+        else:
+            _hash_file(h, path)
+    elif os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                fp = os.path.join(root, name)
+                h.update(os.path.relpath(fp, path).encode("utf-8") + b"\0")
+                if by_stat:
+                    st = os.stat(fp)
+                    h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+                else:
+                    _hash_file(h, fp)
+    else:
+        h.update(b"<missing>")
+    return h.hexdigest()
+
+
+def code_files(script):
+    """The script plus the local src/ modules it imports, recursively."""
+    files, todo = [], [script]
+    while todo:
+        name = todo.pop()
+        if name in files:
+            continue
+        files.append(name)
+        with open(os.path.join(SRC_DIR, name), "r") as f:
+            for module in re.findall(r"^\s*(?:from|import)\s+(\w+)", f.read(), re.M):
+                if os.path.exists(os.path.join(SRC_DIR, f"{module}.py")):
+                    todo.append(f"{module}.py")
+    return sorted(files)
+
+
+def input_hash(stage):
+    h = hashlib.sha256(" ".join(stage_command(stage)[1:]).encode("utf-8"))
+    for rel_path in stage["inputs"] + [f"src/{f}" for f in code_files(stage["script"])]:
+        h.update(rel_path.encode("utf-8") + b"\0" + hash_path(rel_path).encode())
+    return h.hexdigest()
+
+
+def output_hash(stage):
+    h = hashlib.sha256()
+    for rel_path in stage["outputs"]:
+        h.update(hash_path(rel_path).encode())
+    return h.hexdigest()
+
+
+# ------------------------------------------------------
+# Scheduling
+# ------------------------------------------------------
+def _covers(a, b):
+    """True if path a equals path b or one contains the other."""
+    return a == b or a.startswith(b + "/") or b.startswith(a + "/")
+
+
+def dependencies(stages):
+    """{stage name: names of the stages writing one of its inputs}."""
+    return {
+        s["name"]: {o["name"] for o in stages if o is not s and
+                    any(_covers(i, out) for i in s["inputs"] for out in o["outputs"])}
+        for s in stages
+    }
+
+
+def select_stages(targets, llm=False):
+    """The requested stages plus everything upstream of them, in declared order."""
+    deps = dependencies(STAGES)
+    wanted = set(targets or [s["name"] for s in STAGES if llm or not s.get("llm")])
+    todo = list(wanted)
+    while todo:
+        for dep in deps[todo.pop()] - wanted:
+            wanted.add(dep)
+            todo.append(dep)
+    return [s for s in STAGES if s["name"] in wanted]
+
+
+def stage_command(stage, workers=1):
+    command = [sys.executable, os.path.join("src", stage["script"])] + stage.get("args", [])
+    if stage.get("workers") and workers > 1:
+        command += ["--workers", str(workers)]
+    return command
+
+
+def run_stage(stage, workers):
+    """
+    Run one stage script, logging to results/logs/<stage>.log.
+    Returns (exit code, seconds, peak RSS in MiB of the stage and its workers).
+    """
+    start = time.perf_counter()
+    with open(os.path.join(LOG_DIR, f"{stage['name']}.log"), "w") as log:
+        proc = subprocess.Popen(stage_command(stage, workers), cwd=BASE_DIR,
+                                stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives this child's own resource usage (ru_maxrss in KiB)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, time.perf_counter() - start, round(usage.ru_maxrss / 1024, 1)
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, "r") as f:
+        return json.load(f)
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    with open(STATE_FILE + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(STATE_FILE + ".tmp", STATE_FILE)
+
+
+def run_pipeline(stages, jobs=1, workers=1, force=False):
+    """
+    Run stages as soon as their upstream stages are done, up to `jobs` at
+    once. A stage is skipped when its input hash (inputs, code, arguments)
+    and its output hash match the last successful run.
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    # Stage scripts inherit the run id and report into the same profile directory
+    print(f"Run {run_id()}")
+    deps = dependencies(stages)
+    state = load_state()
+    done, failed, running = set(), [], {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            ready = [s for s in stages if s["name"] not in done and s["name"] not in running
+                     and deps[s["name"]] <= done]
+            for stage in ([] if failed else ready):
+                name = stage["name"]
+                key = input_hash(stage)
+                last = state.get(name, {})
+                if not force and last.get("inputs") == key and last.get("outputs") == output_hash(stage):
+                    print(f"[skip] {name} (up to date)")
+                    record(name, 0.0, status="skipped")
+                    done.add(name)
+                    break  # downstream stages may be ready now
+                print(f"[run]  {name}: {' '.join(stage_command(stage, workers)[1:])}")
+                running[name] = (pool.submit(run_stage, stage, workers), key, stage)
+            else:
+                if not running:
+                    break
+                finished, _ = wait([f for f, _, _ in running.values()], return_when=FIRST_COMPLETED)
+                for name, (future, key, stage) in list(running.items()):
+                    if future not in finished:
+                        continue
+                    del running[name]
+                    code, seconds, peak = future.result()
+                    if code != 0:
+                        print(f"[fail] {name} exited with {code}; see {LOG_DIR}/{name}.log")
+                        record(name, seconds, status="failed", exit_code=code, peak_rss_mb=peak)
+                        failed.append(name)
+                        continue
+                    record(name, seconds, status="done", peak_rss_mb=peak)
+                    print(f"[done] {name} ({seconds:.1f}s)")
+                    state[name] = {"inputs": key, "outputs": output_hash(stage)}
+                    save_state(state)
+                    done.add(name)
+
+    write_report("pipeline", jobs=jobs, workers=workers, force=force)
+    if failed:
+        sys.exit(f"Pipeline failed at: {', '.join(failed)}")
+    print("Pipeline complete.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the analysis pipeline, skipping up-to-date stages.")
+    parser.add_argument("stages", nargs="*", metavar="STAGE", help="stages to bring up to date, with their upstream "
+                                              "stages (default: all non-LLM stages)")
+    parser.add_argument("--llm", action="store_true",
+                        help="include the LLM classification stages by default")
+    parser.add_argument("--jobs", type=int, default=2,
+                        help="stages running at once (default: 2)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes passed to stages that support --workers")
+    parser.add_argument("--force", action="store_true",
+                        help="rerun stages even if their inputs are unchanged")
+    args = parser.parse_args()
+    unknown = set(args.stages) - {s["name"] for s in STAGES}
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))} "
+                     f"(choose from {', '.join(s['name'] for s in STAGES)})")
+
+    run_pipeline(select_stages(args.stages, args.llm), jobs=args.jobs, workers=args.workers,
+                 force=args.force)
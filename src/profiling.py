@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+# ------------------------------------------------------
+# Run reports
+# ------------------------------------------------------
+# Scripts time their steps with stage() and finish with write_report(),
+# which writes results/profiles/<run id>/<script>.json. pipeline.py sets
+# RUN_ENV so every stage of one pipeline run reports into the same
+# directory; a script run on its own gets a fresh timestamped run id.
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_DIR = os.path.join(BASE_DIR, "results", "profiles")
+RUN_ENV = "ENRON_PROFILE_RUN"
+
+_STAGES = []
+_START = time.perf_counter()
+
+
+def run_id():
+    """The current run id, created (and exported to child processes) on first use."""
+    if RUN_ENV not in os.environ:
+        os.environ[RUN_ENV] = time.strftime("%Y%m%d-%H%M%S")
+    return os.environ[RUN_ENV]
+
+
+def peak_rss():
+    """
+    High-water resident set size so far, in MiB, of this process and of
+    its largest finished child (e.g. a pool worker).
+    """
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20, 1),
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20, 1),
+    }
+
+
+def record(name, seconds, counts=(), **fields):
+    """
+    Add a stage entry to the report. Every entry of counts (items
+    processed: files, bytes, edges, tokens, ...) also gets a <name>_per_s
+    throughput.
+    """
+    entry = {"stage": name, "seconds": round(seconds, 4), **fields}
+    for key, value in dict(counts).items():
+        entry[key] = value
+        entry[f"{key}_per_s"] = round(value / seconds, 2) if seconds > 0 else None
+    _STAGES.append(entry)
+    return entry
+
+
+@contextmanager
+def stage(name, **counts):
+    """
+    Time a block as one report stage. Yields a dict the block fills with
+    its counts; peak RSS is sampled when the block ends. Stages that raise
+    are not recorded.
+    """
+    counts = dict(counts)
+    start = time.perf_counter()
+    yield counts
+    record(name, time.perf_counter() - start, counts, **peak_rss())
+
+
+def write_report(script, **info):
+    """
+    Write the stages recorded so far, with total wall time, peak RSS and
+    any extra info (arguments, sizes), as JSON. Returns the report path.
+    """
+    report = {
+        "script": script,
+        "run": run_id(),
+        "argv": sys.argv[1:],
+        **info,
+        "seconds": round(time.perf_counter() - _START, 4),
+        **peak_rss(),
+        "stages": _STAGES,
+    }
+    out_dir = os.path.join(PROFILE_DIR, run_id())
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{script}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Profile report: {path}")
+    return path
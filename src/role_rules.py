@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+# ------------------------------------------------------
+# Rule-based role tier (runs before the LLM)
+# ------------------------------------------------------
+# The guideline "Low degree + low centrality → Peripheral Node" made
+# concrete: a node is low on a metric when its value is at or below that
+# metric's LOW_QUANTILE over all nodes. On the heavily zero-inflated Enron
+# metrics this quantile is 0, so it only catches nodes at the floor of
+# every measure; anything else is left to the LLM.
+LOW_QUANTILE = 0.25
+RULE_METRICS = ["degree", "betweenness", "closeness", "pagerank", "eigenvector"]
+
+PERIPHERAL = "Peripheral Node"
+
+
+def low_mask(df, metrics=RULE_METRICS, quantile=LOW_QUANTILE):
+    """
+    Boolean mask of rows at or below the per-metric quantile on every
+    metric (rows with a missing metric are never low). Returns (mask,
+    thresholds).
+    """
+    values = df[metrics].to_numpy(dtype=float)
+    thresholds = np.nanquantile(values, quantile, axis=0)
+    return (values <= thresholds).all(axis=1), thresholds
+
+
+def apply_rules(df, quantile=LOW_QUANTILE):
+    """
+    Assign obvious Peripheral Nodes without the LLM.
+    Returns (ruled, rest): ruled carries a `role` in the LLM's
+    "<role>: <explanation>" format, rest holds the ambiguous rows.
+    """
+    mask, _ = low_mask(df, quantile=quantile)
+    ruled = df[mask].copy()
+    ruled["role"] = (f"{PERIPHERAL}: degree and every centrality measure are at or below "
+                     f"the network's {quantile:.0%} quantile.")
+    return ruled, df[~mask].copy()
+
+
+def merge_tiers(ruled, classified, index):
+    """Recombine rule-assigned and LLM-classified rows in the original order."""
+    ruled = ruled.assign(role_source="rule")
+    classified = classified.assign(role_source="llm")
+    return pd.concat([ruled, classified]).loc[index]
@@ -0,0 +1,56 @@
+import heapq
+
+# ------------------------------------------------------
+# Bounded-memory stream summaries
+# ------------------------------------------------------
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitter summary (Metwally et al.) over at most
+    `capacity` counters. When the summary is full, a new item takes over
+    the smallest counter and inherits its count as its error. Any item
+    seen more than total/capacity times is guaranteed to be kept, and
+    every kept count overestimates the true count by at most its error
+    (itself at most total/capacity).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # Min-heap with one (count, item) entry per kept item. Entries go
+        # stale as counts grow and are refreshed when they reach the top.
+        self._heap = []
+
+    def add(self, item, count=1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self._heap, (count, item))
+            return
+
+        while True:
+            low, victim = self._heap[0]
+            if self.counts[victim] == low:
+                break
+            heapq.heapreplace(self._heap, (self.counts[victim], victim))
+        del self.counts[victim], self.errors[victim]
+        self.counts[item] = low + count
+        self.errors[item] = low
+        heapq.heapreplace(self._heap, (low + count, item))
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def top(self, k):
+        """
+        The k largest (item, estimated count, error) triples; the true
+        count lies in [estimate - error, estimate].
+        """
+        best = heapq.nlargest(k, self.counts.items(), key=lambda kv: kv[1])
+        return [(item, count, self.errors[item]) for item, count in best]
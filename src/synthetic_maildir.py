@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import random
+import argparse
+from itertools import accumulate
+
+# ------------------------------------------------------
+# Synthetic Enron-style maildir
+# ------------------------------------------------------
+# Writes <out>/maildir/<mailbox>/<folder>/<n>. files in the layout of the CMU
+# corpus, so every pipeline stage can be run and benchmarked without it.
+# Sender and recipient activity follow a Zipf law, as in real mail, so the
+# network has hubs. Headers are folded like Outlook exports, and forwarded
+# bodies quote From:/To: lines that the header index must ignore.
+# The same parameters and seed always produce the same tree.
+DEFAULTS = {
+    "mailboxes": 15,        # mailbox owners (the first internal users)
+    "users": 350,           # internal @enron.com addresses
+    "external": 150,        # external addresses
+    "messages": 5000,
+    "recipients": 3.0,      # mean To recipients per message
+    "cc_fraction": 0.25,    # messages with Cc (mirrored in Bcc, as in the corpus)
+    "fold": 0.5,            # messages whose address headers are folded
+    "forward": 0.3,         # messages quoting a forwarded message in the body
+    "body_lines": 12,       # mean body length in lines
+    "zipf": 1.1,            # activity skew of senders and recipients
+    "seed": 0,
+}
+CONFIG_FILE = "synthetic.json"
+
+FOLDERS = ("inbox", "sent", "_sent_mail", "deleted_items", "all_documents")
+START, END = 915148800, 1025481600     # 1999-01-01 .. 2002-07-01 (UTC)
+WORDS = ("gas", "power", "contract", "deal", "meeting", "trading", "desk", "price", "schedule",
+         "review", "california", "pipeline", "storage", "report", "forecast", "please", "thanks")
+
+
+def addresses(users, external):
+    internal = [f"user{i}@enron.com" for i in range(users)]
+    return internal, [f"contact{i}@example{i % 97}.com" for i in range(external)]
+
+
+def format_date(t):
+    return time.strftime("%a, %d %b %Y %H:%M:%S -0700 (PDT)", time.gmtime(t - 7 * 3600))
+
+
+def address_header(name, values, fold):
+    """One address header; folded headers continue every three addresses."""
+    if not fold:
+        return f"{name}: {', '.join(values)}\n"
+    lines = [", ".join(values[i:i + 3]) for i in range(0, len(values), 3)]
+    return f"{name}: " + ",\n\t".join(lines) + "\n"
+
+
+def sentence(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 14))).capitalize() + "."
+
+
+def make_message(rng, n, owner, folder, pick, params):
+    """Return the text of one message stored in owner's folder."""
+    sender = owner if "sent" in folder else pick(1)[0]
+    k = 1 + int(rng.expovariate(1 / (params["recipients"] - 1))) if params["recipients"] > 1 else 1
+    to = list(dict.fromkeys(pick(k)))
+    if "sent" not in folder and owner not in to:
+        to.append(owner)
+    fold = rng.random() < params["fold"]
+    date = rng.randint(START, END)
+
+    lines = [f"Message-ID: <{n}.{params['seed']}.JavaMail.evans@thyme>\n",
+             f"Date: {format_date(date)}\n",
+             f"From: {sender}\n",
+             address_header("To", to, fold)]
+    if rng.random() < params["cc_fraction"]:
+        cc = list(dict.fromkeys(pick(1 + int(rng.expovariate(0.5)))))
+        lines += [address_header("Cc", cc, fold), address_header("Bcc", cc, fold)]
+    lines += [f"Subject: {sentence(rng)[:40]}\n",
+              "Mime-Version: 1.0\n",
+              "Content-Type: text/plain; charset=us-ascii\n",
+              "Content-Transfer-Encoding: 7bit\n",
+              f"X-From: {sender.split('@')[0]}\n",
+              f"X-To: {', '.join(a.split('@')[0] for a in to)}\n",
+              f"X-Folder: \\{owner.split('@')[0]}\\{folder}\n",
+              "X-Origin: SYNTHETIC\n",
+              "\n"]
+    lines += [sentence(rng) + "\n" for _ in range(1 + int(rng.expovariate(1 / params["body_lines"])))]
+    if rng.random() < params["forward"]:
+        lines += ["\n -----Original Message-----\n",
+                  f"From: {pick(1)[0]}\n",
+                  f"Sent: {format_date(date - rng.randint(60, 7 * 86400))}\n",
+                  f"To: {', '.join(pick(2))}\n",
+                  f"Subject: {sentence(rng)[:40]}\n\n",
+                  sentence(rng) + "\n"]
+    return "".join(lines)
+
+
+def generate_maildir(out_dir, **params):
+    """
+    Write a synthetic maildir to out_dir/maildir (see DEFAULTS for the
+    parameters) and its parameters to out_dir/synthetic.json. Returns
+    (messages, bytes) written.
+    """
+    params = {**DEFAULTS, **params}
+    rng = random.Random(params["seed"])
+    internal, external = addresses(params["users"], params["external"])
+    # Mailbox owners are the most active addresses; the rest get random ranks
+    owners = internal[:params["mailboxes"]]
+    others = internal[params["mailboxes"]:] + external
+    rng.shuffle(others)
+    ranked = owners + others
+    cum_weights = list(accumulate(1 / (r + 1) ** params["zipf"] for r in range(len(ranked))))
+
+    def pick(k):
+        return rng.choices(ranked, cum_weights=cum_weights, k=k)
+
+    maildir = os.path.join(out_dir, "maildir")
+    counters = {}
+    n_bytes = 0
+    for n in range(params["messages"]):
+        box = n % len(owners)
+        folder = rng.choice(FOLDERS)
+        folder_dir = os.path.join(maildir, f"box-{box}", folder)
+        if (box, folder) not in counters:
+            os.makedirs(folder_dir, exist_ok=True)
+            counters[box, folder] = 0
+        counters[box, folder] += 1
+        text = make_message(rng, n, owners[box], folder, pick, params)
+        with open(os.path.join(folder_dir, f"{counters[box, folder]}."), "w") as f:
+            f.write(text)
+        n_bytes += len(text)
+
+    with open(os.path.join(out_dir, CONFIG_FILE), "w") as f:
+        json.dump(params, f, indent=2)
+    return params["messages"], n_bytes
+
+
+def scaled(scale, **overrides):
+    """DEFAULTS with mailboxes, addresses and messages multiplied by scale."""
+    params = {**DEFAULTS, **overrides}
+    for key in ("mailboxes", "users", "external", "messages"):
+        params[key] = int(params[key] * scale)
+    return params
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic Enron-style maildir.")
+    parser.add_argument("out_dir", help="directory to create maildir/ in")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply mailboxes, addresses and messages (default: 1; "
+                             "100 is roughly the size of the real corpus)")
+    for key, value in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value,
+                            help=f"(default: {value})")
+    args = vars(parser.parse_args())
+    out_dir, scale = args.pop("out_dir"), args.pop("scale")
+
+    start = time.perf_counter()
+    messages, n_bytes = generate_maildir(out_dir, **scaled(scale, **args))
+    print(f"Wrote {messages} messages ({n_bytes / 2**20:.1f} MiB) to {out_dir}/maildir "
+          f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+import batch_generation
+from batch_generation import generate_continuous
+
+MAX_NEW_TOKENS = 12
+PREFIX = [5, 9, 14, 3, 27, 8]
+SUFFIXES = [[11, 4], [7, 19, 30, 2, 17], [23], [6, 13, 28, 9], [31, 12, 5], [15, 26, 3, 20, 8, 10]]
+
+
+def greedy_reference(model, prompt, eos):
+    """Greedy completion of one prompt by model.generate, ending at the first eos."""
+    ids = torch.tensor([prompt])
+    out = model.generate(ids, attention_mask=torch.ones_like(ids), max_new_tokens=MAX_NEW_TOKENS,
+                         do_sample=False, eos_token_id=eos, pad_token_id=0)
+    tokens = out[0, len(prompt):].tolist()
+    return tokens[:tokens.index(eos) + 1] if eos in tokens else tokens
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    """
+    A tiny random Qwen2 model, with an eos token that ends some greedy
+    completions early and not others (so finished rows leave the batch).
+    """
+    torch.manual_seed(0)
+    config = transformers.Qwen2Config(vocab_size=32, hidden_size=32, intermediate_size=64,
+                                      num_hidden_layers=2, num_attention_heads=4,
+                                      num_key_value_heads=2, max_position_embeddings=128,
+                                      initializer_range=0.5)
+    model = transformers.Qwen2ForCausalLM(config).eval()
+    prompts = [PREFIX + s for s in SUFFIXES]
+    full = [greedy_reference(model, p, eos=None) for p in prompts]
+    # The token that splits the completions most evenly into early/full-length
+    stops = {eos: sum(eos in out[:-1] for out in full) for eos in range(1, config.vocab_size)}
+    eos = max(stops, key=lambda e: min(stops[e], len(full) - stops[e]))
+    model.generation_config.eos_token_id = eos
+    model.generation_config.pad_token_id = 0
+    return model, SimpleNamespace(pad_token_id=0, eos_token_id=eos)
+
+
+@pytest.mark.parametrize("with_prefix", [False, True])
+def test_greedy_matches_generate(tiny_model, monkeypatch, with_prefix):
+    model, tokenizer = tiny_model
+    refills = []
+    merge = batch_generation._merge
+
+    def record_merge(a, b, pad_id):
+        refills.append(a is not None and b is not None)
+        return merge(a, b, pad_id)
+
+    monkeypatch.setattr(batch_generation, "_merge", record_merge)
+
+    prompts = SUFFIXES if with_prefix else [PREFIX + s for s in SUFFIXES]
+    outputs = generate_continuous(model, tokenizer, prompts, max_batch_size=2,
+                                  max_new_tokens=MAX_NEW_TOKENS, do_sample=False,
+                                  refill_fraction=0.5, prefix=PREFIX if with_prefix else None)
+
+    expected = [greedy_reference(model, PREFIX + s, tokenizer.eos_token_id) for s in SUFFIXES]
+    assert outputs == expected
+    # Some rows finished early and waiting prompts joined a running batch
+    assert any(len(out) < MAX_NEW_TOKENS for out in outputs)
+    assert any(refills)
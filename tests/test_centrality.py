@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from centrality import closeness_centrality, closeness_harmonic
+
+
+@pytest.mark.parametrize("n", [0, 1, 5])
+@pytest.mark.parametrize("k", [None, 3])
+def test_closeness_without_edges(n, k):
+    A = sp.csr_array((n, n))
+    result = closeness_harmonic(A, k=k)
+
+    assert set(result) == {"closeness", "harmonic", "closeness_error", "harmonic_error"}
+    for values in result.values():
+        assert values.shape == (n,)
+        assert not values.any()
+    assert closeness_centrality(A).shape == (n,)
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+pytest.importorskip("community")
+from communities import louvain_sweep
+
+
+def test_louvain_without_edges(tmp_path):
+    runs = louvain_sweep(sp.csr_array((4, 4)), seeds=(0, 1), cache_dir=str(tmp_path))
+
+    assert len(runs) == 2
+    for run in runs:
+        assert len(np.unique(run["labels"])) == 4
+        assert np.isnan(run["modularity"])
+    # The undefined modularity survives the partition cache
+    assert all(np.isnan(run["modularity"]) and run["cached"]
+               for run in louvain_sweep(sp.csr_array((4, 4)), seeds=(0, 1), cache_dir=str(tmp_path)))
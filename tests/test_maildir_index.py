@@ -0,0 +1,29 @@
+from maildir_index import build_index, update_index
+
+MESSAGE = ("Message-ID: <{n}@example>\nDate: Mon, 1 Jan 2001 10:00:00 -0700\n"
+           "From: {sender}\nTo: {to}\nSubject: test\n\nBody\n")
+
+
+def write_message(maildir, name, n, sender, to):
+    path = maildir / "box" / "inbox" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(MESSAGE.format(n=n, sender=sender, to=to))
+    return path
+
+
+def test_incremental_update_drops_unreferenced_addresses(tmp_path):
+    maildir = tmp_path / "maildir"
+    write_message(maildir, "1.", 1, "a@enron.com", "b@enron.com")
+    ghost = write_message(maildir, "2.", 2, "a@enron.com", "ghost@enron.com, b@enron.com")
+    old = build_index(str(maildir))
+    assert "ghost@enron.com" in old["addresses"]
+
+    ghost.unlink()
+    write_message(maildir, "3.", 3, "c@enron.com", "a@enron.com")
+    index, added, removed = update_index(old, str(maildir))
+
+    assert index["addresses"] == build_index(str(maildir))["addresses"] == \
+        ["a@enron.com", "b@enron.com", "c@enron.com"]
+    assert [added["addresses"][i] for i in added["from_ids"]] == ["c@enron.com"]
+    # The delta still resolves the removed message's recipients
+    assert sorted(removed["addresses"][i] for i in removed["to_ids"]) == ["b@enron.com", "ghost@enron.com"]
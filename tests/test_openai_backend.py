@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("aiohttp")
+from aiohttp import web
+
+from backends import OpenAIBackend
+from mock_openai_server import ROLES, STATS, make_app
+
+BLOCKS = [f"Node {i}: sent {i * 7} emails" for i in range(24)]
+# {"kind": "drop" or "stall", "count": requests left to fault}
+FAULTS = web.AppKey("faults", dict)
+
+
+@web.middleware
+async def faults(request, handler):
+    """Drop the connection of, or stall, the next faults["count"] requests."""
+    faults = request.app[FAULTS]
+    if faults["count"] > 0:
+        faults["count"] -= 1
+        if faults["kind"] == "drop":
+            request.transport.close()
+        else:
+            await asyncio.sleep(5)
+    return await handler(request)
+
+
+def serve(app):
+    """Run app on a free local port in a background thread; returns (base url, stop)."""
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = runner.addresses[0][1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+    return f"http://127.0.0.1:{port}/v1", stop
+
+
+@pytest.fixture
+def server():
+    app = make_app(delay=0.05)
+    app[FAULTS] = {"kind": None, "count": 0}
+    app.middlewares.append(faults)
+    url, stop = serve(app)
+    yield app, url
+    stop()
+
+
+def test_generate_bounds_requests_in_flight(server):
+    app, url = server
+    backend = OpenAIBackend(url, "mock", concurrency=4)
+    finished = []
+    replies = backend.generate("system", "instructions\n", BLOCKS, answers=[f"{ROLES[0]}:"] * len(BLOCKS),
+                               on_result=lambda j, text: finished.append(j))
+
+    assert len(replies) == len(BLOCKS)
+    assert all(reply == f"{ROLES[0]}: Mock explanation." for reply in replies)
+    assert sorted(finished) == list(range(len(BLOCKS)))
+    assert app[STATS]["requests"] == len(BLOCKS)
+    assert app[STATS]["max_in_flight"] == 4
+    assert backend.usage["generated_tokens"] == 2 * len(BLOCKS)
+
+
+def test_score_returns_labels(server):
+    _, url = server
+    backend = OpenAIBackend(url, "mock", concurrency=8)
+    results = backend.score("system", "instructions\n", BLOCKS, ROLES)
+
+    assert len(results) == len(BLOCKS)
+    for label, probability in results:
+        assert label in ROLES
+        assert 0 < probability <= 1
+
+
+@pytest.mark.parametrize("fault", ["drop", "stall"])
+def test_connection_faults_are_retried(server, fault):
+    app, url = server
+    app[FAULTS].update(kind=fault, count=1)
+    backend = OpenAIBackend(url, "mock", concurrency=2, timeout=1, retries=2)
+    replies = backend.generate("system", "instructions\n", BLOCKS[:4])
+
+    assert len(replies) == 4
+    assert app[FAULTS]["count"] == 0
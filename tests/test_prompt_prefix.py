@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("transformers")
+from tokenizers import Regex, Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast
+
+from backends import HFBackend
+from classify_roles_qwen import INSTRUCTIONS, SYSTEM_PROMPT, make_prompt, metric_blocks
+
+# Pre-tokenizer regex and chat template of the Qwen2 tokenizers
+QWEN_SPLIT = (r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}"
+              r"| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+")
+CHAT_TEMPLATE = ("{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n"
+                 "{% endfor %}{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}")
+
+
+@pytest.fixture(scope="module")
+def rows():
+    return pd.DataFrame({
+        "email": ["a.smith@enron.com", "b.jones@enron.com"], "degree": [12.0, 3.0],
+        "betweenness": [0.01, 0.0], "closeness": [0.3, 0.1], "pagerank": [2e-4, 1e-5],
+        "eigenvector": [0.05, 0.0], "community": [4, 7],
+    })
+
+
+@pytest.fixture(scope="module")
+def tokenizer(rows):
+    """A small byte-level BPE with Qwen's pre-tokenizer, trained on the prompts."""
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.Sequence([
+        pre_tokenizers.Split(Regex(QWEN_SPLIT), behavior="isolated"),
+        pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False),
+    ])
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=600, special_tokens=["<|endoftext|>", "<|im_start|>", "<|im_end|>"],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tok.train_from_iterator([make_prompt(row) for _, row in rows.iterrows()] * 20, trainer)
+    fast = PreTrainedTokenizerFast(tokenizer_object=tok, eos_token="<|im_end|>", pad_token="<|endoftext|>")
+    fast.chat_template = CHAT_TEMPLATE
+    return fast
+
+
+def split(tokenizer, instructions, blocks):
+    backend = HFBackend(SimpleNamespace(name_or_path="test"), tokenizer, batch_size=4, max_new_tokens=8)
+    prefix_ids, chunks = backend._split(SYSTEM_PROMPT, instructions, blocks)
+    return backend, prefix_ids, [ids for chunk in chunks for ids in chunk]
+
+
+def test_prefix_and_suffix_tokenize_like_the_whole_prompt(tokenizer, rows):
+    blocks = metric_blocks(rows)
+    backend, prefix_ids, suffix_ids = split(tokenizer, INSTRUCTIONS, blocks)
+
+    for block, ids in zip(blocks, suffix_ids):
+        whole = tokenizer(backend.chat_text(SYSTEM_PROMPT, INSTRUCTIONS + block),
+                          add_special_tokens=False)["input_ids"]
+        assert prefix_ids + ids == whole
+
+
+def test_seam_inside_a_token_is_rejected(tokenizer, rows):
+    # The former layout split ":\n\n" between the instructions and the rows
+    assert ":\n\n" in tokenizer.convert_tokens_to_string(tokenizer.tokenize(":\n\n")[:1])
+    blocks = ["\n" + block for block in metric_blocks(rows)]
+    with pytest.raises(ValueError, match="token boundary"):
+        split(tokenizer, INSTRUCTIONS[:-1], blocks)